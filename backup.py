@@ -0,0 +1,225 @@
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PREFIX = 'keys-'
+SNAPSHOT_SUFFIX = '.db.gz'
+
+
+class BackupError(Exception):
+    """Снимок не прошел проверку целостности"""
+
+
+def _integrity_check(path):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise BackupError(f"integrity_check {path}: {result}")
+
+
+def _copy_online(src_path, dst_path, pages, step_sleep):
+    """Копирует базу через SQLite online backup API.
+
+    За один шаг копируется pages страниц, между шагами блокировка
+    источника отпускается на step_sleep секунд, чтобы бот мог писать.
+    """
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        def progress(status, remaining, total):
+            if remaining and step_sleep:
+                time.sleep(step_sleep)
+
+        src.backup(dst, pages=pages, progress=progress)
+        return dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+
+
+def list_snapshots(backup_dir):
+    """Снимки в каталоге, от новых к старым"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [
+        name for name in os.listdir(backup_dir)
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+    ]
+    return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+
+def create_backup(db_path, backup_dir, pages=256, step_sleep=0.05, keep=14):
+    """Делает проверенный сжатый снимок базы и удаляет старые.
+
+    Возвращает словарь с путем снимка и метриками.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    started = time.monotonic()
+    name = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    raw_path = os.path.join(backup_dir, name + '.db.tmp')
+    snapshot_path = os.path.join(backup_dir, name + SNAPSHOT_SUFFIX)
+
+    try:
+        page_count = _copy_online(db_path, raw_path, pages, step_sleep)
+        copied = time.monotonic()
+        _integrity_check(raw_path)
+
+        with open(raw_path, 'rb') as raw, gzip.open(snapshot_path + '.tmp', 'wb') as packed:
+            shutil.copyfileobj(raw, packed)
+        os.replace(snapshot_path + '.tmp', snapshot_path)
+        db_bytes = os.path.getsize(raw_path)
+    finally:
+        for path in (raw_path, snapshot_path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    for old in list_snapshots(backup_dir)[keep:]:
+        os.remove(old)
+
+    return {
+        'path': snapshot_path,
+        'pages': page_count,
+        'db_bytes': db_bytes,
+        'compressed_bytes': os.path.getsize(snapshot_path),
+        'copy_seconds': copied - started,
+        'total_seconds': time.monotonic() - started,
+        'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def restore_backup(snapshot_path, db_path):
+    """Восстанавливает базу из снимка.
+
+    Снимок распаковывается и проверяется, затем копируется поверх базы
+    через backup API (под блокировкой SQLite, без подмены файла).
+    Бота на время восстановления лучше остановить.
+    """
+    raw_path = db_path + '.restore.tmp'
+    try:
+        with gzip.open(snapshot_path, 'rb') as packed, open(raw_path, 'wb') as raw:
+            shutil.copyfileobj(packed, raw)
+        _integrity_check(raw_path)
+        _copy_online(raw_path, db_path, pages=-1, step_sleep=0)
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+
+class BackupManager:
+    """Периодические снимки базы в фоновом потоке с метриками последнего запуска"""
+
+    def __init__(self, db_path, backup_dir, interval, pages=256, step_sleep=0.05, keep=14):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.pages = pages
+        self.step_sleep = step_sleep
+        self.keep = keep
+        self.last_result = None
+        self.last_error = None
+        self.runs = 0
+        self.failures = 0
+        self._lock = asyncio.Lock()
+
+    async def backup_now(self):
+        """Делает снимок в отдельном потоке, event loop не блокируется"""
+        async with self._lock:
+            try:
+                result = await asyncio.to_thread(
+                    create_backup, self.db_path, self.backup_dir,
+                    self.pages, self.step_sleep, self.keep
+                )
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                logger.error(f"Backup failed: {e}")
+                raise
+            self.runs += 1
+            self.last_result = result
+            self.last_error = None
+            logger.info("Backup created", extra={'backup': result})
+            return result
+
+    def next_delay(self):
+        """Секунды до следующего снимка по возрасту самого свежего снимка на диске.
+
+        Отсчет идет от файла, а не от старта процесса: иначе бот, который
+        перезапускают чаще interval, не получил бы ни одного снимка.
+        """
+        snapshots = list_snapshots(self.backup_dir)
+        if not snapshots:
+            return 0
+        age = time.time() - os.path.getmtime(snapshots[0])
+        return max(0, self.interval - age)
+
+    async def run(self, retry_delay=300):
+        while True:
+            await asyncio.sleep(self.next_delay())
+            try:
+                await self.backup_now()
+            except Exception:
+                # Снимка не появилось - повторяем раньше, чем через interval
+                await asyncio.sleep(min(self.interval, retry_delay))
+
+
+def tenant_backup_dir(backup_dir, bots, name):
+    """Каталог снимков бота: общий при одном боте, иначе подкаталог с его именем"""
+    return backup_dir if len(bots) == 1 else os.path.join(backup_dir, name)
+
+
+if __name__ == '__main__':
+    # python backup.py [--bot имя | --db база --dir каталог] create | list | restore <файл снимка>
+    import argparse
+
+    from config import BACKUP_DIR, BACKUP_KEEP, BOTS
+
+    parser = argparse.ArgumentParser(description="Резервные копии базы бота")
+    parser.add_argument('command', choices=['create', 'list', 'restore'])
+    parser.add_argument('snapshot', nargs='?', help="файл снимка для restore")
+    parser.add_argument('--bot', help="имя бота из BOTS (по умолчанию первый)")
+    parser.add_argument('--db', help="путь к базе вместо базы бота")
+    parser.add_argument('--dir', help="каталог снимков вместо каталога бота")
+    parser.add_argument('--force', action='store_true',
+                        help="восстановить снимок не из каталога этого бота")
+    args = parser.parse_args()
+
+    bots = {settings['name']: settings for settings in BOTS}
+    name = args.bot or BOTS[0]['name']
+    if name not in bots:
+        parser.error(f"нет бота {name}, есть: {', '.join(bots)}")
+    db_path = args.db or bots[name].get('db', 'keys.db')
+    backup_dir = args.dir or tenant_backup_dir(BACKUP_DIR, BOTS, name)
+
+    if args.command == 'create':
+        result = create_backup(db_path, backup_dir, keep=BACKUP_KEEP)
+        print(f"✅ Снимок создан: {result['path']} "
+              f"({result['db_bytes']} -> {result['compressed_bytes']} байт, "
+              f"{result['total_seconds']:.2f} с)")
+    elif args.command == 'list':
+        snapshots = list_snapshots(backup_dir)
+        if not snapshots:
+            print(f"📭 Снимков нет в {backup_dir}")
+        for path in snapshots:
+            print(f"{path}  {os.path.getsize(path)} байт")
+    else:
+        if not args.snapshot:
+            parser.error("укажите файл снимка")
+        # Снимок другого бота поверх этой базы - почти наверняка ошибка
+        snapshot_dir = os.path.dirname(os.path.abspath(args.snapshot))
+        if snapshot_dir != os.path.abspath(backup_dir) and not args.force:
+            print(f"❌ Снимок не из {backup_dir} (бот {name}, база {db_path}). "
+                  f"Укажите --bot, --db или --force")
+            sys.exit(1)
+        restore_backup(args.snapshot, db_path)
+        print(f"✅ База {db_path} восстановлена из {args.snapshot}")
@@ -0,0 +1,101 @@
+"""Микробенчмарк: стоимость выбора обработчика callback-а.
+
+Сравнивает прежнюю схему (цепочка F.data == ... / F.data.startswith(...),
+которую aiogram проверяет по очереди, плюс split('_') в обработчике) с
+CallbackRouter (разбор данных + один поиск в словаре). Для наглядности
+добавляет N фиктивных маршрутов, чтобы показать рост стоимости цепочки.
+
+    python bench_callback_routing.py
+"""
+import timeit
+from types import SimpleNamespace
+
+from callbacks import CallbackRouter, cb
+
+try:
+    from magic_filter import F
+except ImportError:
+    F = None
+
+# Маршруты бота в порядке прежней регистрации: (старое условие, новое действие, имя числа)
+ROUTES = [
+    (('eq', 'buy_key'), 'buy', None),
+    (('prefix', 'buy_'), 'tariff', 'tariff'),
+    (('prefix', 'approve_'), 'approve', 'payment_id'),
+    (('prefix', 'delete_'), 'delete', 'payment_id'),
+    (('prefix', 'reply_'), 'reply', 'payment_id'),
+    (('eq', 'my_keys'), 'keys', None),
+    (('eq', 'help'), 'help', None),
+    (('eq', 'main_menu'), 'menu', None),
+    (('eq', 'admin_stats_chart'), 'adm_chart', None),
+    (('eq', 'admin_all_payments'), 'adm_pay', None),
+    (('eq', 'admin_back'), 'adm_back', None),
+]
+
+# Типичная смесь нажатий: меню, тарифы, кнопки администраторов
+OLD_SAMPLE = ['main_menu', 'buy_key', 'buy_1_month', 'my_keys', 'approve_1234',
+              'reply_1234', 'admin_all_payments', 'help']
+NEW_SAMPLE = [cb('menu'), cb('buy'), cb('tariff', 30), cb('keys'), cb('approve', 1234),
+              cb('reply', 1234), cb('adm_pay'), cb('help')]
+
+
+def build_old_chain(extra):
+    # Дополнительные обработчики ставим перед существующими: каждый из них
+    # проверяется до того, как цепочка дойдет до нужного
+    chain = [('eq', f'extra_{index}') for index in range(extra)]
+    chain += [condition for condition, _, _ in ROUTES]
+    if F is not None:
+        return [
+            F.data == value if kind == 'eq' else F.data.startswith(value)
+            for kind, value in chain
+        ]
+    return [
+        (lambda data, value=value: data == value) if kind == 'eq'
+        else (lambda data, value=value: data.startswith(value))
+        for kind, value in chain
+    ]
+
+
+def old_route(chain, callback):
+    for index, condition in enumerate(chain):
+        matched = condition.resolve(callback) if F is not None else condition(callback.data)
+        if matched:
+            # Обработчики с числом разбирали его сами
+            if '_' in callback.data and callback.data.rsplit('_', 1)[-1].isdigit():
+                int(callback.data.split('_')[1])
+            return index
+    return None
+
+
+def build_router(extra):
+    router = CallbackRouter()
+
+    async def handler(callback, **kwargs):
+        pass
+
+    for _, action, value_name in ROUTES:
+        router.route(action, value_name)(handler)
+    for index in range(extra):
+        router.route(f'extra_{index}')(handler)
+    return router
+
+
+def bench(function, samples, number):
+    callbacks = [SimpleNamespace(data=data) for data in samples]
+    total = timeit.timeit(lambda: [function(callback) for callback in callbacks], number=number)
+    return total / (number * len(callbacks)) * 1e9
+
+
+def main(number=20000):
+    print(f"Фильтры: {'magic_filter' if F is not None else 'эмуляция без aiogram'}")
+    print(f"{'маршрутов':>10}{'цепочка, нс':>14}{'словарь, нс':>14}{'ускорение':>12}")
+    for extra in (0, 20, 100):
+        chain = build_old_chain(extra)
+        router = build_router(extra)
+        old_ns = bench(lambda callback: old_route(chain, callback), OLD_SAMPLE, number)
+        new_ns = bench(lambda callback: router.resolve(callback.data), NEW_SAMPLE, number)
+        print(f"{len(ROUTES) + extra:>10}{old_ns:>14.0f}{new_ns:>14.0f}{old_ns / new_ns:>11.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Бенчмарк холодного старта: время от запуска процесса до первого обработанного апдейта.
+
+Каждый прогон - отдельный процесс python с bot.py на копии базы во
+временном каталоге; Telegram API заменен фейковой сессией (из replay.py),
+которая на первый getUpdates отдает один /start. Пример:
+
+    python bench_cold_start.py --runs 10 --api-latency 50
+    python bench_cold_start.py --json new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def child(latency):
+    """Один запуск бота внутри процесса-прогона; печатает JSON с профилем"""
+    from startup import profile
+
+    import bot as app
+    from aiogram.methods import GetUpdates
+    from aiogram.types import Update
+    from replay import make_fake_session
+
+    pending = [Update.model_validate({
+        'update_id': 1,
+        'message': {
+            'message_id': 1,
+            'date': int(time.time()),
+            'chat': {'id': 1000, 'type': 'private'},
+            'from': {'id': 1000, 'is_bot': False, 'first_name': 'bench'},
+            'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    })]
+    session = make_fake_session(latency)
+    fake_request = session.make_request
+
+    async def make_request(bot, method, timeout=None):
+        if isinstance(method, GetUpdates):
+            if latency:
+                await asyncio.sleep(latency)
+            if pending:
+                return [pending.pop()]
+            # Длинный опрос без новых апдейтов
+            await asyncio.sleep(1)
+            return []
+        return await fake_request(bot, method, timeout)
+
+    session.make_request = make_request
+    for tenant in app.tenants:
+        tenant.bot.session = session
+
+    async def stop_after_first(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            asyncio.get_running_loop().create_task(app.dp.stop_polling())
+
+    app.dp.update.outer_middleware(stop_after_first)
+    asyncio.run(app.main())
+
+    result = profile.as_dict()
+    # Момент первого апдейта в часах системы - для сравнения со временем запуска процесса
+    result['first_update_wall'] = time.time() - (profile.elapsed() - profile.first_update)
+    result['api_calls'] = dict(session.calls)
+    print('BENCH ' + json.dumps(result))
+
+
+def run_once(source_db, latency_ms):
+    workdir = tempfile.mkdtemp(prefix='cold-start-')
+    try:
+        if source_db and os.path.exists(source_db):
+            from backup import _copy_online
+            _copy_online(source_db, os.path.join(workdir, 'keys.db'), pages=-1, step_sleep=0)
+        env = dict(os.environ, RECORD_UPDATES='', PYTHONPATH=HERE)
+        started = time.time()
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', '--api-latency', str(latency_ms)],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        ).stdout
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    line = next(line for line in output.splitlines() if line.startswith('BENCH '))
+    result = json.loads(line[len('BENCH '):])
+    result['process_to_first_update_ms'] = (result['first_update_wall'] - started) * 1000
+    return result
+
+
+def summarize(results):
+    phases = {}
+    for result in results:
+        for phase in result['phases']:
+            phases.setdefault(phase['name'], []).append(phase)
+    totals = [result['process_to_first_update_ms'] for result in results]
+    return {
+        'runs': len(results),
+        'process_to_first_update_ms': {
+            'median': statistics.median(totals), 'min': min(totals), 'max': max(totals),
+        },
+        'phases': {
+            name: {
+                'start_ms': statistics.median(item['start_ms'] for item in items),
+                'duration_ms': statistics.median(item['duration_ms'] for item in items),
+            }
+            for name, items in sorted(phases.items(), key=lambda entry: entry[1][0]['start_ms'])
+        },
+    }
+
+
+def print_summary(summary, baseline=None):
+    total = summary['process_to_first_update_ms']
+    line = (f"Запуск процесса -> первый апдейт: медиана {total['median']:.1f} мс "
+            f"(мин {total['min']:.1f}, макс {total['max']:.1f}), прогонов: {summary['runs']}")
+    if baseline:
+        old = baseline['process_to_first_update_ms']['median']
+        line += f"  ({(total['median'] - old) / old * 100:+.1f}% к базе)"
+    print(line)
+    print(f"{'фаза':<28}{'начало, мс':>12}{'длит., мс':>12}")
+    for name, phase in summary['phases'].items():
+        print(f"{name:<28}{phase['start_ms']:>12.1f}{phase['duration_ms']:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время холодного старта бота")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--db', default='keys.db', help="база, копия которой используется")
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help="искусственная задержка ответа Telegram API, мс")
+    parser.add_argument('--json', help="сохранить сводку в JSON")
+    parser.add_argument('--baseline', help="JSON-сводка прошлой сборки для сравнения")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.api_latency / 1000)
+        return
+
+    source_db = os.path.abspath(args.db)
+    results = [run_once(source_db, args.api_latency) for _ in range(args.runs)]
+    summary = summarize(results)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_summary(summary, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
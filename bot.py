@@ -1,6 +1,8 @@
+# Первым: отсчет профиля запуска начинается до тяжелых импортов aiogram
+from startup import profile
+
 import asyncio
 import logging
-import sys
 from datetime import datetime, timedelta
 
 from aiogram import Bot, Dispatcher, types, F
@@ -9,28 +11,123 @@ from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, BufferedInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+
+from config import (
+    BOTS, HOST_ADMIN_IDS, DEDUP_CACHE_SIZE, CLAIM_LEASE_SECONDS,
+    SEND_RATE_PER_SECOND, SEND_CONCURRENCY, SEND_GLOBAL_RATE_PER_SECOND,
+    LOG_LEVEL, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_SAMPLE_RATES,
+    BACKUP_DIR, BACKUP_INTERVAL_SECONDS, BACKUP_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_STEP_SLEEP,
+    STATS_ROLLUP_INTERVAL_SECONDS,
+    WG_CACHE_DIR, WG_POOL_WORKERS,
+    RECORD_UPDATES, RECORD_DIR
+)
+from database import Database, PaymentConflictError
+from middlewares import (
+    DedupMiddleware, LogContextMiddleware, HandlerNameMiddleware, RecordingMiddleware,
+    StartupProfileMiddleware
+)
+from recorder import UpdateRecorder
+from callbacks import CallbackRouter, cb
+from logging_setup import setup_logging
+from sender import RateLimiter
+from outbox import OutboxWorker
+from bulk import build_plan
+from backup import BackupManager, list_snapshots, tenant_backup_dir
+from stats import run_rollups, render_chart
+from wireguard import ConfigGenerator, check_client_networks, shutdown_executor
+from tenants import Tenant, TenantAttribute, TenantMiddleware, check_databases
 
-from config import BOT_TOKEN, ADMIN_IDS
-from database import Database
+profile.checkpoint('imports')
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
+# Настройка логирования (JSON, запись в фоновом потоке)
+setup_logging(
+    level=LOG_LEVEL,
+    log_file=LOG_FILE,
+    max_bytes=LOG_MAX_BYTES,
+    backup_count=LOG_BACKUP_COUNT,
+    sample_rates=LOG_SAMPLE_RATES
 )
 logger = logging.getLogger(__name__)
+profile.checkpoint('logging')
 
-# Инициализация бота
-bot = Bot(
-    token=BOT_TOKEN, 
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+# Общие для всех ботов процесса: пул HTTP-соединений и потолок отправки (если задан)
+http_session = AiohttpSession()
+global_send_limiter = (
+    RateLimiter(SEND_GLOBAL_RATE_PER_SECOND) if SEND_GLOBAL_RATE_PER_SECOND else None
 )
+
+def wireguard_enabled(settings):
+    return bool(settings.get('wireguard', {}).get('server_public_key'))
+
+def create_tenant(settings):
+    """Собирает бота с его базой, outbox, резервными копиями и конфигами WireGuard"""
+    tenant_bot = Bot(
+        token=settings['token'], 
+        session=http_session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    # Схема базы проверяется в main() параллельно с первым getUpdates
+    tenant_db = Database(settings.get('db', 'keys.db'), lazy=True)
+    admin_ids = settings['admin_ids']
+    # Флуд-лимиты Telegram считаются по токену: у каждого бота свой ограничитель,
+    # и retry_after одного бота не останавливает отправку остальных
+    send_limiter = RateLimiter(SEND_RATE_PER_SECOND, parent=global_send_limiter)
+    tenant_outbox = OutboxWorker(tenant_db, tenant_bot, send_limiter, concurrency=SEND_CONCURRENCY)
+    # Генерация конфигов WireGuard (если задан публичный ключ сервера)
+    tenant_wg_configs = ConfigGenerator(
+        tenant_db, tenant_outbox,
+        settings=settings['wireguard'],
+        cache_dir=WG_CACHE_DIR,
+        admin_ids=admin_ids,
+        max_workers=WG_POOL_WORKERS
+    ) if wireguard_enabled(settings) else None
+    tenant_backups = BackupManager(
+        tenant_db.db_name,
+        tenant_backup_dir(BACKUP_DIR, BOTS, settings['name']),
+        BACKUP_INTERVAL_SECONDS,
+        pages=BACKUP_PAGES_PER_STEP, step_sleep=BACKUP_STEP_SLEEP, keep=BACKUP_KEEP
+    )
+    return Tenant(
+        settings['name'], tenant_bot, tenant_db, admin_ids,
+        tenant_outbox, tenant_backups, tenant_wg_configs
+    )
+
+# Инициализация ботов. Общая база или одинаковые адреса клиентов у разных
+# ботов - ошибка конфигурации, такой процесс не запускается
+check_databases(BOTS)
+check_client_networks({
+    settings['name']: settings['wireguard'] for settings in BOTS if wireguard_enabled(settings)
+})
+tenants = [create_tenant(settings) for settings in BOTS]
+
+# Обработчики обращаются к bot, db, ADMIN_IDS... как раньше, а получают
+# объекты того бота, которому пришел апдейт
+bot = TenantAttribute('bot')
+db = TenantAttribute('db')
+ADMIN_IDS = TenantAttribute('admin_ids')
+outbox = TenantAttribute('outbox')
+backups = TenantAttribute('backups')
+wg_configs = TenantAttribute('wg_configs')
+
 dp = Dispatcher(storage=MemoryStorage())
-db = Database()
+dp.update.outer_middleware(DedupMiddleware(DEDUP_CACHE_SIZE))
+dp.update.outer_middleware(LogContextMiddleware())
+dp.update.outer_middleware(TenantMiddleware(tenants))
+# Запись трафика для нагрузочных сравнений (replay.py)
+recorder = UpdateRecorder(
+    RECORD_DIR, [admin_id for tenant in tenants for admin_id in tenant.admin_ids]
+) if RECORD_UPDATES else None
+if recorder:
+    dp.update.outer_middleware(RecordingMiddleware(recorder))
+dp.message.middleware(HandlerNameMiddleware())
+dp.update.outer_middleware(StartupProfileMiddleware(profile, logger))
+
+# Все callback-и идут через один обработчик и словарь маршрутов
+callbacks = CallbackRouter()
 
 # Состояния для FSM
 class UserStates(StatesGroup):
@@ -39,6 +136,64 @@ class UserStates(StatesGroup):
 class AdminStates(StatesGroup):
     waiting_for_key_input = State()
     waiting_for_reply = State()
+    waiting_for_bulk_file = State()
+
+def format_duration(duration):
+    return {
+        30: "1 месяц",
+        90: "3 месяца",
+        180: "6 месяцев",
+        365: "1 год"
+    }.get(duration, f"{duration} дней")
+
+def key_issued_text(vpn_key, duration):
+    """Сообщение пользователю о выданном ключе"""
+    if wg_configs:
+        instructions = (
+            f"<b>Как использовать:</b>\n"
+            f"1. Установите приложение WireGuard\n"
+            f"2. Импортируйте файл конфига или отсканируйте QR-код - "
+            f"они придут следующими сообщениями\n\n"
+        )
+    else:
+        instructions = (
+            f"<b>Как использовать:</b>\n"
+            f"1. Установите приложение WireGuard\n"
+            f"2. Добавьте новый туннель\n"
+            f"3. Введите ключ: <code>{vpn_key}</code>\n"
+            f"4. Настройте сервер по инструкции\n\n"
+        )
+    return (
+        f"🎉 <b>Ваш платеж подтвержден!</b>\n\n"
+        f"🔑 <b>Ваш ключ VPN:</b> <code>{vpn_key}</code>\n"
+        f"⏱ <b>Срок действия:</b> {format_duration(duration)}\n\n"
+        f"{instructions}"
+        f"<i>При проблемах обращайтесь: @razetkaartem</i>"
+    )
+
+def payment_admin_keyboard(payment_id):
+    """Кнопки администратора под уведомлением о платеже"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        types.InlineKeyboardButton(
+            text="🔑 Выдать ключ", 
+            callback_data=cb("approve", payment_id)
+        )
+    )
+    builder.row(
+        types.InlineKeyboardButton(
+            text="💬 Ответить",
+            callback_data=cb("reply", payment_id)
+        ),
+        types.InlineKeyboardButton(
+            text="🗑️ Удалить",
+            callback_data=cb("delete", payment_id)
+        )
+    )
+    return builder.as_markup()
+
+LEASE_TAKEN_TEXT = "🔒 Платеж уже взят в работу другим администратором"
+COMMAND_IN_INPUT_TEXT = "⚠️ Сейчас ожидается текст (ключ или ответ). Отправьте его или <code>/cancel</code>"
 
 # Команда /start
 @dp.message(CommandStart())
@@ -51,9 +206,9 @@ async def cmd_start(message: types.Message):
     
     builder = InlineKeyboardBuilder()
     builder.add(
-        types.InlineKeyboardButton(text="💰 Купить ключ", callback_data="buy_key"),
-        types.InlineKeyboardButton(text="🌐 Мои ключи", callback_data="my_keys"),
-        types.InlineKeyboardButton(text="⚠️ Помощь", callback_data="help"),
+        types.InlineKeyboardButton(text="💰 Купить ключ", callback_data=cb("buy")),
+        types.InlineKeyboardButton(text="🌐 Мои ключи", callback_data=cb("keys")),
+        types.InlineKeyboardButton(text="⚠️ Помощь", callback_data=cb("help")),
         types.InlineKeyboardButton(text="👨‍💻 Поддержка", url="t.me/razetkaartem")
     )
     builder.adjust(2, 2)
@@ -66,15 +221,15 @@ async def cmd_start(message: types.Message):
     )
 
 # Кнопка "Купить ключ"
-@dp.callback_query(F.data == "buy_key")
+@callbacks.route("buy")
 async def process_buy_key(callback: CallbackQuery):
     builder = InlineKeyboardBuilder()
     builder.add(
-        types.InlineKeyboardButton(text="1 месяц - 100 руб", callback_data="buy_1_month"),
-        types.InlineKeyboardButton(text="3 месяца - 250 руб", callback_data="buy_3_months"),
-        types.InlineKeyboardButton(text="6 месяцев - 450 руб", callback_data="buy_6_months"),
-        types.InlineKeyboardButton(text="1 год - 800 руб", callback_data="buy_1_year"),
-        types.InlineKeyboardButton(text="Назад", callback_data="main_menu")
+        types.InlineKeyboardButton(text="1 месяц - 100 руб", callback_data=cb("tariff", 30)),
+        types.InlineKeyboardButton(text="3 месяца - 250 руб", callback_data=cb("tariff", 90)),
+        types.InlineKeyboardButton(text="6 месяцев - 450 руб", callback_data=cb("tariff", 180)),
+        types.InlineKeyboardButton(text="1 год - 800 руб", callback_data=cb("tariff", 365)),
+        types.InlineKeyboardButton(text="Назад", callback_data=cb("menu"))
     )
     builder.adjust(2, 2, 1)
     
@@ -90,16 +245,15 @@ async def process_buy_key(callback: CallbackQuery):
     await callback.answer()
 
 # Обработка выбора тарифа
-@dp.callback_query(F.data.startswith('buy_'))
-async def process_tariff_selection(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("tariff", "tariff")
+async def process_tariff_selection(callback: CallbackQuery, state: FSMContext, tariff: int):
     tariff_map = {
-        'buy_1_month': {'duration': 30, 'price': 100, 'name': '1 месяц'},
-        'buy_3_months': {'duration': 90, 'price': 250, 'name': '3 месяца'},
-        'buy_6_months': {'duration': 180, 'price': 450, 'name': '6 месяцев'},
-        'buy_1_year': {'duration': 365, 'price': 800, 'name': '1 год'}
+        30: {'duration': 30, 'price': 100, 'name': '1 месяц'},
+        90: {'duration': 90, 'price': 250, 'name': '3 месяца'},
+        180: {'duration': 180, 'price': 450, 'name': '6 месяцев'},
+        365: {'duration': 365, 'price': 800, 'name': '1 год'}
     }
     
-    tariff = callback.data
     if tariff in tariff_map:
         await state.update_data(tariff=tariff_map[tariff])
         
@@ -114,7 +268,7 @@ async def process_tariff_selection(callback: CallbackQuery, state: FSMContext):
         # Создаем клавиатуру с кнопкой "Назад"
         builder = InlineKeyboardBuilder()
         builder.add(
-            types.InlineKeyboardButton(text="Назад", callback_data="buy_key")
+            types.InlineKeyboardButton(text="Назад", callback_data=cb("buy"))
         )
         
         await callback.message.edit_text(
@@ -143,24 +297,6 @@ async def process_payment_proof(message: types.Message, state: FSMContext):
     # Уведомляем администраторов
     for admin_id in ADMIN_IDS:
         try:
-            builder = InlineKeyboardBuilder()
-            builder.row(
-                types.InlineKeyboardButton(
-                    text="🔑 Выдать ключ", 
-                    callback_data=f"approve_{payment_id}"
-                )
-            )
-            builder.row(
-                types.InlineKeyboardButton(
-                    text="💬 Ответить",
-                    callback_data=f"reply_{payment_id}"
-                ),
-                types.InlineKeyboardButton(
-                    text="🗑️ Удалить",
-                    callback_data=f"delete_{payment_id}"
-                )
-            )
-            
             await bot.send_photo(
                 chat_id=admin_id,
                 photo=message.photo[-1].file_id,
@@ -170,9 +306,10 @@ async def process_payment_proof(message: types.Message, state: FSMContext):
                     f"💰 <b>Сумма:</b> {tariff['price']} руб\n"
                     f"⏱ <b>Срок:</b> {tariff['name']}\n"
                     f"🆔 <b>ID:</b> {user_id}\n"
-                    f"📝 <b>ID платежа:</b> {payment_id}"
+                    f"📝 <b>ID платежа:</b> {payment_id}\n\n"
+                    f"<i>Взять следующий платеж из очереди: /next</i>"
                 ),
-                reply_markup=builder.as_markup()
+                reply_markup=payment_admin_keyboard(payment_id)
             )
         except Exception as e:
             logger.error(f"Error sending to admin {admin_id}: {e}")
@@ -180,7 +317,7 @@ async def process_payment_proof(message: types.Message, state: FSMContext):
     # Создаем клавиатуру с кнопкой "Назад" для пользователя
     builder = InlineKeyboardBuilder()
     builder.add(
-        types.InlineKeyboardButton(text="Назад в меню", callback_data="main_menu")
+        types.InlineKeyboardButton(text="Назад в меню", callback_data=cb("menu"))
     )
     
     await message.answer(
@@ -192,15 +329,13 @@ async def process_payment_proof(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Админ: обработка кнопки "Выдать ключ"
-@dp.callback_query(F.data.startswith('approve_'))
-async def process_approve_payment(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("approve", "payment_id")
+async def process_approve_payment(callback: CallbackQuery, state: FSMContext, payment_id: int):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("⛔ Нет прав!", show_alert=True)
         return
     
     try:
-        payment_id = int(callback.data.split('_')[1])
-        
         # Получаем информацию о платеже
         payment = db.get_payment_by_id(payment_id)
         
@@ -208,10 +343,15 @@ async def process_approve_payment(callback: CallbackQuery, state: FSMContext):
             await callback.answer("❌ Платеж не найден!", show_alert=True)
             return
         
-        if payment['status'] == 'approved':
+        if payment['status'] != 'pending':
             await callback.answer("⚠️ Этот платеж уже обработан!", show_alert=True)
             return
         
+        # Закрепляем платеж за администратором, чтобы не было двойной работы
+        if not db.claim_payment(payment_id, callback.from_user.id, CLAIM_LEASE_SECONDS):
+            await callback.answer(LEASE_TAKEN_TEXT, show_alert=True)
+            return
+        
         # Сохраняем данные платежа в состоянии
         await state.update_data(
             payment_id=payment_id,
@@ -248,19 +388,19 @@ async def process_approve_payment(callback: CallbackQuery, state: FSMContext):
         await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
 
 # Админ: удаление платежа
-@dp.callback_query(F.data.startswith('delete_'))
-async def process_delete_payment(callback: CallbackQuery):
+@callbacks.route("delete", "payment_id")
+async def process_delete_payment(callback: CallbackQuery, payment_id: int):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("⛔ Нет прав!", show_alert=True)
         return
     
     try:
-        payment_id = int(callback.data.split('_')[1])
-        
-        # Удаляем платеж из базы
-        deleted = db.delete_payment(payment_id)
+        # Удаляем платеж из базы (pending - только держателем брони)
+        deleted = db.delete_payment(payment_id, callback.from_user.id)
         
-        if deleted:
+        if not deleted and db.get_payment_by_id(payment_id):
+            await callback.answer(LEASE_TAKEN_TEXT, show_alert=True)
+        elif deleted:
             await callback.answer("✅ Платеж удален", show_alert=True)
             
             # Отправляем отдельное подтверждение
@@ -273,15 +413,13 @@ async def process_delete_payment(callback: CallbackQuery):
         await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
 
 # Админ: ответ пользователю
-@dp.callback_query(F.data.startswith('reply_'))
-async def process_reply_to_payment(callback: CallbackQuery, state: FSMContext):
+@callbacks.route("reply", "payment_id")
+async def process_reply_to_payment(callback: CallbackQuery, state: FSMContext, payment_id: int):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("⛔ Нет прав!", show_alert=True)
         return
     
     try:
-        payment_id = int(callback.data.split('_')[1])
-        
         # Получаем информацию о платеже
         payment = db.get_payment_by_id(payment_id)
         
@@ -289,6 +427,12 @@ async def process_reply_to_payment(callback: CallbackQuery, state: FSMContext):
             await callback.answer("❌ Платеж не найден!", show_alert=True)
             return
         
+        if payment['status'] == 'pending' and not db.claim_payment(
+            payment_id, callback.from_user.id, CLAIM_LEASE_SECONDS
+        ):
+            await callback.answer(LEASE_TAKEN_TEXT, show_alert=True)
+            return
+        
         # Сохраняем данные для ответа
         await state.update_data(
             reply_payment_id=payment_id,
@@ -314,7 +458,7 @@ async def process_reply_to_payment(callback: CallbackQuery, state: FSMContext):
         await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
 
 # Админ: прием ответа пользователю
-@dp.message(AdminStates.waiting_for_reply)
+@dp.message(AdminStates.waiting_for_reply, F.text)
 async def process_admin_reply(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMIN_IDS:
         await state.clear()
@@ -322,9 +466,16 @@ async def process_admin_reply(message: types.Message, state: FSMContext):
     
     # Проверяем отмену
     if message.text.strip() == "/cancel":
+        user_data = await state.get_data()
+        # Возвращаем платеж в очередь
+        db.release_claim(user_data.get('reply_payment_id'), message.from_user.id)
         await message.answer("❌ Ответ отменен")
         await state.clear()
         return
+    if message.text.startswith('/'):
+        # Команда (например /next), а не текст ответа пользователю
+        await message.answer(COMMAND_IN_INPUT_TEXT)
+        return
     
     try:
         user_data = await state.get_data()
@@ -338,30 +489,23 @@ async def process_admin_reply(message: types.Message, state: FSMContext):
             await message.answer("❌ Текст ответа не может быть пустым!")
             return
         
-        # Отправляем ответ пользователю
-        try:
-            await bot.send_message(
-                chat_id=user_id,
-                text=f"💬 <b>Ответ от администратора:</b>\n\n{reply_text}"
-            )
-            
-            # Уведомляем администратора об успехе
-            await message.answer(
-                f"✅ <b>Ответ отправлен!</b>\n\n"
-                f"👤 <b>Пользователю:</b> @{username}\n"
-                f"🆔 <b>ID:</b> {user_id}\n"
-                f"📝 <b>ID платежа:</b> {payment_id}\n\n"
-                f"<b>Текст:</b>\n{reply_text}"
-            )
-            
-        except Exception as e:
-            logger.error(f"Error sending reply to user {user_id}: {e}")
-            await message.answer(
-                f"❌ <b>Не удалось отправить ответ</b>\n\n"
-                f"<b>Причина:</b> {str(e)}\n\n"
-                f"<b>Текст ответа:</b>\n{reply_text}\n\n"
-                f"<i>Пользователь мог заблокировать бота</i>"
-            )
+        # Ставим ответ в очередь отправки, доставит OutboxWorker
+        db.add_outbox_message(
+            user_id,
+            f"💬 <b>Ответ от администратора:</b>\n\n{reply_text}"
+        )
+        outbox.wake()
+        # Ответ отправлен - платеж снова доступен в /next
+        db.release_claim(payment_id, message.from_user.id)
+        
+        # Уведомляем администратора
+        await message.answer(
+            f"✅ <b>Ответ поставлен в очередь отправки!</b>\n\n"
+            f"👤 <b>Пользователю:</b> @{username}\n"
+            f"🆔 <b>ID:</b> {user_id}\n"
+            f"📝 <b>ID платежа:</b> {payment_id}\n\n"
+            f"<b>Текст:</b>\n{reply_text}"
+        )
         
         await state.clear()
         
@@ -371,7 +515,7 @@ async def process_admin_reply(message: types.Message, state: FSMContext):
         await state.clear()
 
 # Админ: прием ключа от администратора
-@dp.message(AdminStates.waiting_for_key_input)
+@dp.message(AdminStates.waiting_for_key_input, F.text)
 async def process_admin_key_input(message: types.Message, state: FSMContext):
     if message.from_user.id not in ADMIN_IDS:
         await state.clear()
@@ -379,9 +523,16 @@ async def process_admin_key_input(message: types.Message, state: FSMContext):
     
     # Проверяем отмену
     if message.text.strip() == "/cancel":
+        user_data = await state.get_data()
+        # Возвращаем платеж в очередь
+        db.release_claim(user_data.get('payment_id'), message.from_user.id)
         await message.answer("❌ Выдача ключа отменена")
         await state.clear()
         return
+    if message.text.startswith('/'):
+        # Команда (например /next), а не ключ
+        await message.answer(COMMAND_IN_INPUT_TEXT)
+        return
     
     try:
         user_data = await state.get_data()
@@ -398,58 +549,36 @@ async def process_admin_key_input(message: types.Message, state: FSMContext):
             await message.answer("❌ Ключ слишком короткий! Минимум 5 символов.")
             return
         
-        # Обновляем платеж с ключом
-        db.update_payment_with_key(payment_id, vpn_key)
-        
-        # Добавляем ключ пользователю
-        db.add_key(user_id, vpn_key, user_data['duration'])
-        
-        # Формируем сообщение для пользователя
-        duration_name = {
-            30: "1 месяц",
-            90: "3 месяца",
-            180: "6 месяцев",
-            365: "1 год"
-        }.get(user_data['duration'], f"{user_data['duration']} дней")
-        
-        user_message = (
-            f"🎉 <b>Ваш платеж подтвержден!</b>\n\n"
-            f"🔑 <b>Ваш ключ VPN:</b> <code>{vpn_key}</code>\n"
-            f"⏱ <b>Срок действия:</b> {duration_name}\n\n"
-            f"<b>Как использовать:</b>\n"
-            f"1. Установите приложение WireGuard\n"
-            f"2. Добавьте новый туннель\n"
-            f"3. Введите ключ: <code>{vpn_key}</code>\n"
-            f"4. Настройте сервер по инструкции\n\n"
-            f"<i>При проблемах обращайтесь: @razetkaartem</i>"
+        # Подтверждаем платеж, добавляем ключ и ставим сообщение пользователю
+        # в outbox одной транзакцией (только из pending)
+        key_id = db.issue_key(
+            payment_id, user_id, vpn_key, user_data['duration'],
+            config_url=None if wg_configs else "",
+            admin_id=message.from_user.id,
+            notification=key_issued_text(vpn_key, user_data['duration'])
         )
-        
-        # Отправляем ключ пользователю
-        try:
-            await bot.send_message(
-                chat_id=user_id,
-                text=user_message
-            )
-            
-            # Уведомляем администратора об успехе
-            await message.answer(
-                f"✅ <b>Ключ успешно выдан!</b>\n\n"
-                f"👤 <b>Пользователь:</b> {user_data['username']}\n"
-                f"🆔 <b>ID:</b> {user_id}\n"
-                f"🔑 <b>Ключ:</b> <code>{vpn_key}</code>\n"
-                f"⏱ <b>Срок:</b> {duration_name}\n"
-                f"💰 <b>Сумма:</b> {user_data['amount']} руб"
-            )
-            
-        except Exception as e:
-            logger.error(f"Error sending key to user {user_id}: {e}")
+        if not key_id:
             await message.answer(
-                f"⚠️ <b>Ключ сохранен, но не отправлен пользователю</b>\n\n"
-                f"<b>Причина:</b> {str(e)}\n\n"
-                f"<b>Ключ:</b> <code>{vpn_key}</code>\n"
-                f"<b>ID пользователя:</b> {user_id}\n\n"
-                f"<i>Отправьте ключ пользователю вручную</i>"
+                f"⚠️ Платеж ID {payment_id} уже обработан или взят другим "
+                f"администратором, ключ не выдан"
             )
+            await state.clear()
+            return
+        outbox.wake()
+        if wg_configs:
+            # Конфиг и QR собираются в пуле процессов и придут через outbox
+            wg_configs.schedule(key_id, user_id, message.from_user.id)
+        
+        # Уведомляем администратора об успехе
+        await message.answer(
+            f"✅ <b>Ключ успешно выдан!</b>\n\n"
+            f"👤 <b>Пользователь:</b> {user_data['username']}\n"
+            f"🆔 <b>ID:</b> {user_id}\n"
+            f"🔑 <b>Ключ:</b> <code>{vpn_key}</code>\n"
+            f"⏱ <b>Срок:</b> {format_duration(user_data['duration'])}\n"
+            f"💰 <b>Сумма:</b> {user_data['amount']} руб\n\n"
+            f"<i>Сообщение пользователю отправляется в фоне</i>"
+        )
         
         await state.clear()
         
@@ -458,8 +587,14 @@ async def process_admin_key_input(message: types.Message, state: FSMContext):
         await message.answer(f"❌ <b>Ошибка:</b> {str(e)}")
         await state.clear()
 
+# Админ: фото, файл или стикер вместо текста ключа / ответа
+@dp.message(AdminStates.waiting_for_key_input)
+@dp.message(AdminStates.waiting_for_reply)
+async def process_admin_non_text_input(message: types.Message):
+    await message.answer(COMMAND_IN_INPUT_TEXT)
+
 # Показать мои ключи
-@dp.callback_query(F.data == "my_keys")
+@callbacks.route("keys")
 async def process_my_keys(callback: CallbackQuery):
     user_id = callback.from_user.id
     keys = db.get_user_keys(user_id)
@@ -467,8 +602,8 @@ async def process_my_keys(callback: CallbackQuery):
     if not keys:
         builder = InlineKeyboardBuilder()
         builder.add(
-            types.InlineKeyboardButton(text="💰 Купить ключ", callback_data="buy_key"),
-            types.InlineKeyboardButton(text="Назад", callback_data="main_menu")
+            types.InlineKeyboardButton(text="💰 Купить ключ", callback_data=cb("buy")),
+            types.InlineKeyboardButton(text="Назад", callback_data=cb("menu"))
         )
         builder.adjust(2)
         
@@ -498,7 +633,7 @@ async def process_my_keys(callback: CallbackQuery):
     
     builder = InlineKeyboardBuilder()
     builder.add(
-        types.InlineKeyboardButton(text="Назад", callback_data="main_menu")
+        types.InlineKeyboardButton(text="Назад", callback_data=cb("menu"))
     )
     
     await callback.message.edit_text(
@@ -508,7 +643,7 @@ async def process_my_keys(callback: CallbackQuery):
     await callback.answer()
 
 # Помощь
-@dp.callback_query(F.data == "help")
+@callbacks.route("help")
 async def process_help(callback: CallbackQuery):
     help_text = (
         "⚠️ <b>Часто задаваемые вопросы:</b>\n\n"
@@ -535,7 +670,7 @@ async def process_help(callback: CallbackQuery):
     )
     
     builder = InlineKeyboardBuilder()
-    builder.add(types.InlineKeyboardButton(text="Назад", callback_data="main_menu"))
+    builder.add(types.InlineKeyboardButton(text="Назад", callback_data=cb("menu")))
     
     await callback.message.edit_text(
         help_text,
@@ -544,7 +679,7 @@ async def process_help(callback: CallbackQuery):
     await callback.answer()
 
 # Возврат в главное меню
-@dp.callback_query(F.data == "main_menu")
+@callbacks.route("menu")
 async def process_main_menu(callback: CallbackQuery):
     user_id = callback.from_user.id
     username = callback.from_user.username or "Без имени"
@@ -553,9 +688,9 @@ async def process_main_menu(callback: CallbackQuery):
     
     builder = InlineKeyboardBuilder()
     builder.add(
-        types.InlineKeyboardButton(text="💰 Купить ключ", callback_data="buy_key"),
-        types.InlineKeyboardButton(text="🌐 Мои ключи", callback_data="my_keys"),
-        types.InlineKeyboardButton(text="⚠️ Помощь", callback_data="help"),
+        types.InlineKeyboardButton(text="💰 Купить ключ", callback_data=cb("buy")),
+        types.InlineKeyboardButton(text="🌐 Мои ключи", callback_data=cb("keys")),
+        types.InlineKeyboardButton(text="⚠️ Помощь", callback_data=cb("help")),
         types.InlineKeyboardButton(text="👨‍💻 Поддержка", url="t.me/razetkaartem")
     )
     builder.adjust(2, 2)
@@ -577,20 +712,33 @@ async def cmd_admin(message: types.Message):
     
     # Получаем статистику
     user_count = db.get_user_count()
-    pending_payments = db.get_pending_payments()
+    queue = db.get_queue_stats()
+    admin_stats = db.get_admin_stats()
+    outbox_stats = db.get_outbox_stats()
     
     stats_text = (
         f"👨‍💻 <b>Админ-панель</b>\n\n"
         f"📊 Статистика:\n"
         f"• Пользователей: {user_count}\n"
-        f"• Ожидающих платежей: {len(pending_payments)}\n\n"
-        f"<i>Для выдачи ключа нажмите кнопку в уведомлении о платеже</i>"
+        f"• В очереди: {queue['queued']}\n"
+        f"• В работе у администраторов: {queue['claimed']}\n"
+        f"• Сообщений в очереди отправки: {outbox_stats['pending']}\n"
+        f"• Не доставлено: {outbox_stats['dead']}\n\n"
+    )
+    if admin_stats:
+        stats_text += "👥 <b>Выдано ключей (сутки / всего):</b>\n"
+        for row in admin_stats:
+            stats_text += f"• <code>{row['admin_id']}</code>: {row['last_day']} / {row['total']}\n"
+        stats_text += "\n"
+    stats_text += (
+        "<i>Взять следующий платеж из очереди: /next\n"
+        "Статистика продаж: /stats</i>"
     )
     
     builder = InlineKeyboardBuilder()
     builder.add(
-        types.InlineKeyboardButton(text="📋 Все платежи", callback_data="admin_all_payments"),
-        types.InlineKeyboardButton(text="Назад", callback_data="main_menu")
+        types.InlineKeyboardButton(text="📋 Все платежи", callback_data=cb("adm_pay")),
+        types.InlineKeyboardButton(text="Назад", callback_data=cb("menu"))
     )
     builder.adjust(2)
     
@@ -599,8 +747,274 @@ async def cmd_admin(message: types.Message):
         reply_markup=builder.as_markup()
     )
 
+# Админ: взять следующий платеж из очереди
+@dp.message(Command("next"))
+async def cmd_next(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ У вас нет доступа к админ-панели.")
+        return
+    
+    payment = db.claim_next_payment(message.from_user.id, CLAIM_LEASE_SECONDS)
+    if not payment:
+        await message.answer("📭 Очередь пуста — все платежи разобраны")
+        return
+    
+    duration_name = {
+        30: "1 месяц",
+        90: "3 месяца",
+        180: "6 месяцев",
+        365: "1 год"
+    }.get(payment['duration'], f"{payment['duration']} дней")
+    
+    await message.answer_photo(
+        photo=payment['proof_photo_id'],
+        caption=(
+            f"📥 <b>Платеж из очереди</b>\n\n"
+            f"👤 <b>Пользователь:</b> @{payment.get('username') or 'Без имени'}\n"
+            f"💰 <b>Сумма:</b> {payment['amount']} руб\n"
+            f"⏱ <b>Срок:</b> {duration_name}\n"
+            f"🆔 <b>ID:</b> {payment['user_id']}\n"
+            f"📝 <b>ID платежа:</b> {payment['id']}\n\n"
+            f"<i>Закреплен за вами на {CLAIM_LEASE_SECONDS // 60} мин</i>"
+        ),
+        reply_markup=payment_admin_keyboard(payment['id'])
+    )
+
+# Админ: массовая выдача ключей из файла
+@dp.message(Command("bulk"))
+async def cmd_bulk(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ У вас нет доступа к админ-панели.")
+        return
+    
+    args = message.text.split()[1:]
+    duration = None
+    if args:
+        if not args[0].isdigit():
+            await message.answer("❌ Срок указывается в днях, например: <code>/bulk 30</code>")
+            return
+        duration = int(args[0])
+    
+    await state.set_state(AdminStates.waiting_for_bulk_file)
+    await state.update_data(bulk_duration=duration)
+    
+    if duration is None:
+        file_format = (
+            "Каждая строка: <code>ID_платежа;ключ</code>\n"
+            "Ключи будут выданы указанным платежам."
+        )
+    else:
+        file_format = (
+            "Каждая строка: один ключ.\n"
+            f"Ключи получат самые старые ожидающие платежи на {format_duration(duration)}."
+        )
+    await message.answer(
+        f"📦 <b>Массовая выдача ключей</b>\n\n"
+        f"Пришлите текстовый файл.\n{file_format}\n\n"
+        f"<code>/cancel</code> - отменить"
+    )
+
+@dp.message(AdminStates.waiting_for_bulk_file, F.document)
+async def process_bulk_file(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        await state.clear()
+        return
+    
+    admin_id = message.from_user.id
+    user_data = await state.get_data()
+    duration = user_data.get('bulk_duration')
+    
+    if message.document.file_size and message.document.file_size > 1024 * 1024:
+        await message.answer("❌ Файл слишком большой (максимум 1 МБ)")
+        return
+    
+    try:
+        content = await bot.download(message.document)
+        text = content.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        await message.answer("❌ Файл должен быть в кодировке UTF-8")
+        return
+    except Exception as e:
+        logger.error(f"Error downloading bulk file: {e}")
+        await message.answer(f"❌ <b>Не удалось скачать файл:</b> {str(e)}")
+        return
+    
+    plan = build_plan(db, text, admin_id, duration)
+    assignments = plan['assignments']
+    
+    if plan['errors']:
+        errors = "\n".join(f"• {error}" for error in plan['errors'][:20])
+        more = len(plan['errors']) - 20
+        if more > 0:
+            errors += f"\n• ... и еще {more}"
+        await message.answer(
+            f"❌ <b>Файл не принят, ничего не выдано</b>\n\n{errors}\n\n"
+            f"Исправьте файл и пришлите снова или <code>/cancel</code>"
+        )
+        return
+    
+    if not assignments:
+        await message.answer("📭 Нет подходящих ожидающих платежей")
+        await state.clear()
+        return
+    
+    # Все записи и сообщения пользователям - одной транзакцией
+    for item in assignments:
+        item['notification'] = key_issued_text(item['key'], item['duration'])
+        item['config_url'] = None if wg_configs else ""
+    try:
+        db.issue_keys_bulk(assignments, admin_id)
+    except PaymentConflictError as e:
+        await message.answer(
+            f"⚠️ Платеж ID {e.payment_id} успели обработать, пока файл проверялся.\n"
+            f"Ничего не выдано, пришлите файл снова."
+        )
+        return
+    await state.clear()
+    outbox.wake()
+    if wg_configs:
+        for item in assignments:
+            wg_configs.schedule(item['key_id'], item['user_id'], admin_id)
+    
+    report = (
+        f"✅ <b>Массовая выдача завершена</b>\n\n"
+        f"• Выдано ключей: {len(assignments)}\n"
+        f"• Сумма: {sum(item['amount'] for item in assignments)} руб\n"
+        f"• Сообщения пользователям поставлены в очередь отправки\n"
+    )
+    if plan['unused']:
+        report += f"• Лишних ключей (не хватило платежей): {len(plan['unused'])}\n"
+        report += "\n<b>Неиспользованные ключи:</b>\n"
+        report += "\n".join(f"<code>{key}</code>" for key in plan['unused'][:20])
+    
+    await message.answer(report)
+
+@dp.message(AdminStates.waiting_for_bulk_file)
+async def process_bulk_file_text(message: types.Message, state: FSMContext):
+    if message.text and message.text.strip() == "/cancel":
+        await message.answer("❌ Массовая выдача отменена")
+        await state.clear()
+        return
+    
+    await message.answer("📎 Пришлите файл с ключами или <code>/cancel</code>")
+
+# Админ: резервная копия базы
+@dp.message(Command("backup"))
+async def cmd_backup(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ У вас нет доступа к админ-панели.")
+        return
+    
+    await message.answer("⏳ Создаю резервную копию...")
+    try:
+        result = await backups.backup_now()
+    except Exception as e:
+        await message.answer(f"❌ <b>Ошибка резервного копирования:</b> {str(e)}")
+        return
+    
+    await message.answer(
+        f"💾 <b>Резервная копия создана</b>\n\n"
+        f"📁 <b>Файл:</b> <code>{result['path']}</code>\n"
+        f"📦 <b>Размер:</b> {result['db_bytes'] // 1024} КБ → {result['compressed_bytes'] // 1024} КБ\n"
+        f"⏱ <b>Копирование:</b> {result['copy_seconds']:.2f} с (всего {result['total_seconds']:.2f} с)\n"
+        f"🗂 <b>Снимков хранится:</b> {len(list_snapshots(backups.backup_dir))}\n"
+        f"📊 <b>Успешно / ошибок:</b> {backups.runs} / {backups.failures}\n\n"
+        f"<i>Восстановление (бот остановлен): python backup.py restore &lt;файл&gt;</i>"
+    )
+
+# Админ: статистика продаж
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ У вас нет доступа к админ-панели.")
+        return
+    
+    # Досчитываем только то, что появилось после прошлого пересчета
+    text = "📊 <b>Статистика продаж</b>\n"
+    try:
+        await asyncio.to_thread(db.rollup_daily_stats)
+    except Exception as e:
+        # Например, database is locked, пока идет периодический пересчет:
+        # показываем уже посчитанное
+        logger.warning(f"Stats rollup in /stats failed: {e}")
+        text += "<i>⚠️ Без последних минут: пересчет не удался, данные прошлого пересчета</i>\n"
+    for days in (7, 30, 365):
+        summary = db.get_stats_summary(days)
+        median = summary['median_approval_seconds']
+        median_text = f"{median / 60:.0f} мин" if median is not None else "нет данных"
+        text += (
+            f"\n<b>За {days} дней:</b>\n"
+            f"• Новых пользователей: {summary['new_users']}\n"
+            f"• Платежей получено: {summary['payments_submitted']}\n"
+            f"• Платежей подтверждено: {summary['payments_approved']}\n"
+            f"• Выручка: {summary['revenue']:.0f} руб\n"
+            f"• Время подтверждения (медиана, ±5%): {median_text}\n"
+        )
+        for row in summary['by_duration']:
+            text += f"   ◦ {format_duration(row['duration'])}: {row['approved']} шт, {row['revenue']:.0f} руб\n"
+    
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        types.InlineKeyboardButton(text="📈 График за 30 дней", callback_data=cb("adm_chart"))
+    )
+    
+    await message.answer(
+        text,
+        reply_markup=builder.as_markup()
+    )
+
+@callbacks.route("adm_chart")
+async def admin_stats_chart(callback: CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("⛔ Нет прав!", show_alert=True)
+        return
+    
+    rows = db.get_daily_stats(30)
+    if not rows:
+        await callback.answer("📭 Нет данных за 30 дней", show_alert=True)
+        return
+    
+    await callback.answer("⏳ Рисую график...")
+    try:
+        # Рендеринг в отдельном потоке, чтобы не блокировать обработку апдейтов
+        png = await asyncio.to_thread(render_chart, rows)
+    except ImportError:
+        await callback.message.answer("❌ Для графиков установите matplotlib: <code>pip install matplotlib</code>")
+        return
+    except Exception as e:
+        logger.error(f"Error in admin_stats_chart: {e}")
+        await callback.message.answer(f"❌ <b>Ошибка:</b> {str(e)}")
+        return
+    
+    await callback.message.answer_photo(
+        BufferedInputFile(png, filename="stats.png"),
+        caption="📈 Выручка и подтверждения за 30 дней"
+    )
+
+# Нагрузка по ботам процесса (видна администраторам хоста)
+@dp.message(Command("tenants"))
+async def cmd_tenants(message: types.Message):
+    if message.from_user.id not in HOST_ADMIN_IDS:
+        await message.answer("⛔ У вас нет доступа к админ-панели.")
+        return
+    
+    total_seconds = sum(tenant.metrics.handler_seconds for tenant in tenants) or 1
+    text = f"🏢 <b>Боты процесса:</b> {len(tenants)}\n\n"
+    for tenant in tenants:
+        metrics = tenant.metrics
+        average_ms = metrics.handler_seconds / metrics.updates * 1000 if metrics.updates else 0
+        text += (
+            f"<b>{tenant.name}</b>\n"
+            f"• Апдейтов: {metrics.updates}, ошибок: {metrics.errors}\n"
+            f"• Время обработчиков: {metrics.handler_seconds:.1f} с "
+            f"({metrics.handler_seconds / total_seconds * 100:.0f}% от всех)\n"
+            f"• Среднее / максимум: {average_ms:.1f} / {metrics.max_seconds * 1000:.0f} мс\n"
+            f"• В очереди отправки: {tenant.db.get_outbox_stats()['pending']}\n\n"
+        )
+    await message.answer(text)
+
 # Просмотр всех платежей
-@dp.callback_query(F.data == "admin_all_payments")
+@callbacks.route("adm_pay")
 async def admin_all_payments(callback: CallbackQuery):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("⛔ Нет прав!", show_alert=True)
@@ -635,9 +1049,9 @@ async def admin_all_payments(callback: CallbackQuery):
         
         builder = InlineKeyboardBuilder()
         builder.add(
-            types.InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_all_payments"),
-            types.InlineKeyboardButton(text="Назад в админку", callback_data="admin_back"),
-            types.InlineKeyboardButton(text="Главное меню", callback_data="main_menu")
+            types.InlineKeyboardButton(text="🔄 Обновить", callback_data=cb("adm_pay")),
+            types.InlineKeyboardButton(text="Назад в админку", callback_data=cb("adm_back")),
+            types.InlineKeyboardButton(text="Главное меню", callback_data=cb("menu"))
         )
         builder.adjust(1, 2)
         
@@ -652,7 +1066,7 @@ async def admin_all_payments(callback: CallbackQuery):
         await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
 
 # Назад в админку
-@dp.callback_query(F.data == "admin_back")
+@callbacks.route("adm_back")
 async def admin_back(callback: CallbackQuery):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("⛔ Нет прав!", show_alert=True)
@@ -686,24 +1100,108 @@ async def handle_text(message: types.Message):
         await message.answer("Используйте кнопки меню для навигации.")
 
 # Обработка неизвестных callback-ов
-@dp.callback_query()
 async def handle_unknown_callback(callback: CallbackQuery):
     await callback.answer("⚠️ Эта кнопка больше не активна. Используйте /start", show_alert=True)
 
+callbacks.fallback = handle_unknown_callback
+
+# Единая точка входа для всех callback-ов: разбор данных и поиск в словаре
+@dp.callback_query()
+async def route_callback(callback: CallbackQuery, state: FSMContext):
+    await callbacks.dispatch(callback, state)
+
+async def prepare_database(tenant, attempts=5, delay=1):
+    """Проверка схемы с повторами: база может быть временно заблокирована"""
+    for attempt in range(1, attempts + 1):
+        try:
+            with profile.phase(f'schema {tenant.name}'):
+                await asyncio.to_thread(tenant.db.prepare)
+            return True
+        except Exception as e:
+            logger.error(
+                f"Bot {tenant.name}: database prepare failed (attempt {attempt}/{attempts}): {e}"
+            )
+            if attempt < attempts:
+                await asyncio.sleep(delay * 2 ** (attempt - 1))
+    return False
+
+async def prepare_tenant(tenant, background):
+    """Проверка схемы, прогрев кэшей и фоновые задачи одного бота.
+
+    Идет параллельно с поллингом: апдейт, пришедший раньше, подождет
+    только ту часть, которая ему нужна (Database.prepare под блокировкой).
+    Воркеры запускаются в любом случае: если схему так и не удалось
+    проверить, каждое их обращение к базе повторит prepare и запишет ошибку в лог.
+    """
+    if await prepare_database(tenant):
+        try:
+            with profile.phase(f'warm-up {tenant.name}'):
+                # Страницы горячих таблиц в кэш SQLite до первых нажатий администраторов
+                await asyncio.to_thread(tenant.db.get_queue_stats)
+                await asyncio.to_thread(tenant.db.get_outbox_stats)
+        except Exception as e:
+            logger.warning(f"Bot {tenant.name}: cache warm-up failed: {e}")
+    
+    # Фоновая доставка сообщений пользователям
+    background.append(asyncio.create_task(tenant.outbox.run()))
+    # Периодические резервные копии базы
+    background.append(asyncio.create_task(tenant.backups.run()))
+    # Инкрементальный пересчет дневной статистики
+    background.append(asyncio.create_task(
+        run_rollups(tenant.db, STATS_ROLLUP_INTERVAL_SECONDS)
+    ))
+    if tenant.wg_configs:
+        # Конфиги, не собранные до перезапуска
+        try:
+            tenant.wg_configs.resume()
+        except Exception as e:
+            logger.error(f"Bot {tenant.name}: error resuming WireGuard configs: {e}")
+
 async def main():
-    # Удаляем вебхук (если был)
-    await bot.delete_webhook(drop_pending_updates=True)
+    profile.checkpoint('setup')
     
-    print("🤖 VPN Бот запускается...")
-    print(f"Админские ID: {ADMIN_IDS}")
-    print("Для остановки нажмите Ctrl+C")
+    # Удаляем вебхуки (если были); getMe, который поллинг запросит первым
+    # делом, выполняем параллельно - aiogram кэширует ответ в bot.me()
+    with profile.phase('webhook + getMe'):
+        await asyncio.gather(*(
+            request
+            for tenant in tenants
+            for request in (tenant.bot.delete_webhook(drop_pending_updates=True), tenant.bot.me())
+        ))
     
-    # Запускаем поллинг
-    await dp.start_polling(bot)
+    logger.info("🤖 VPN Бот запускается...")
+    for tenant in tenants:
+        logger.info(f"Бот {tenant.name}: админские ID {tenant.admin_ids}")
+    logger.info("Для остановки нажмите Ctrl+C")
+    
+    background = []
+    preparing = [asyncio.create_task(prepare_tenant(tenant, background)) for tenant in tenants]
+    if recorder:
+        recorder.start()
+    
+    # Запускаем поллинг всех ботов в одном event loop
+    profile.mark('polling')
+    try:
+        await dp.start_polling(*(tenant.bot for tenant in tenants))
+    finally:
+        for task in preparing:
+            task.cancel()
+        await asyncio.gather(*preparing, return_exceptions=True)
+        for tenant in tenants:
+            tenant.outbox.stop()
+            if tenant.wg_configs:
+                await tenant.wg_configs.close()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        shutdown_executor()
+        if recorder:
+            recorder.stop()
+        await http_session.close()
 
 if __name__ == '__main__':
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
 
-        print("\n👋 Бот остановлен")
+        logger.info("👋 Бот остановлен")
@@ -0,0 +1,87 @@
+import re
+
+MIN_KEY_LENGTH = 5
+
+# Разделитель между ID платежа и ключом: ; , таб или пробелы
+_SEPARATOR = re.compile(r'\s*[;,\t]\s*|\s+')
+
+
+def _lines(text):
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line_no, line
+
+
+def parse_mapping(text):
+    """Разбирает строки вида "ID_платежа;ключ". Возвращает (пары, ошибки)"""
+    pairs, errors = [], []
+    for line_no, line in _lines(text):
+        parts = _SEPARATOR.split(line, maxsplit=1)
+        if len(parts) != 2 or not parts[0].isdigit():
+            errors.append(f"строка {line_no}: ожидается \"ID_платежа;ключ\"")
+            continue
+        pairs.append((line_no, int(parts[0]), parts[1].strip()))
+    return pairs, errors
+
+
+def parse_keys(text):
+    """Разбирает файл со списком ключей, по одному в строке"""
+    return [(line_no, line) for line_no, line in _lines(text)]
+
+
+def build_plan(db, text, admin_id, duration=None):
+    """Проверяет файл и сопоставляет ключи платежам.
+
+    Без duration файл - это пары "ID_платежа;ключ". С duration - список
+    ключей, которые раздаются самым старым pending-платежам этого срока.
+    Возвращает словарь с assignments, errors и unused (лишние ключи).
+    """
+    if duration is None:
+        entries, errors = parse_mapping(text)
+    else:
+        entries = [(line_no, None, key) for line_no, key in parse_keys(text)]
+        errors = []
+
+    seen_keys, seen_ids = set(), set()
+    for line_no, payment_id, key in entries:
+        if len(key) < MIN_KEY_LENGTH:
+            errors.append(f"строка {line_no}: ключ короче {MIN_KEY_LENGTH} символов")
+        if key in seen_keys:
+            errors.append(f"строка {line_no}: ключ повторяется в файле")
+        seen_keys.add(key)
+        if payment_id is not None:
+            if payment_id in seen_ids:
+                errors.append(f"строка {line_no}: платеж {payment_id} указан повторно")
+            seen_ids.add(payment_id)
+
+    for key in db.get_existing_keys(seen_keys):
+        errors.append(f"ключ {key} уже выдан ранее")
+
+    unused = []
+    if duration is None:
+        payments = db.get_claimable_payments(seen_ids, admin_id)
+        for line_no, payment_id, key in entries:
+            if payment_id not in payments:
+                errors.append(
+                    f"строка {line_no}: платеж {payment_id} не найден, уже обработан "
+                    f"или в работе у другого администратора"
+                )
+        matched = [(payments.get(payment_id), key) for _, payment_id, key in entries]
+    else:
+        payments = db.get_oldest_claimable_payments(duration, len(entries), admin_id)
+        matched = list(zip(payments, (key for _, _, key in entries)))
+        unused = [key for _, _, key in entries[len(payments):]]
+
+    assignments = [
+        {
+            'payment_id': payment['id'],
+            'user_id': payment['user_id'],
+            'amount': payment['amount'],
+            'duration': payment['duration'],
+            'key': key,
+        }
+        for payment, key in matched
+        if payment
+    ]
+    return {'assignments': assignments, 'errors': errors, 'unused': unused}
@@ -0,0 +1,93 @@
+import inspect
+
+from logging_setup import log_context
+
+# Формат callback_data: "действие" или "действие:число", например "approve:12"
+SEPARATOR = ':'
+
+# Кнопки, отправленные до перехода на новый формат (старые сообщения в чатах)
+LEGACY_EXACT = {
+    'buy_key': ('buy', None),
+    'my_keys': ('keys', None),
+    'help': ('help', None),
+    'main_menu': ('menu', None),
+    'admin_all_payments': ('adm_pay', None),
+    'admin_back': ('adm_back', None),
+    'admin_stats_chart': ('adm_chart', None),
+    'buy_1_month': ('tariff', 30),
+    'buy_3_months': ('tariff', 90),
+    'buy_6_months': ('tariff', 180),
+    'buy_1_year': ('tariff', 365),
+}
+LEGACY_PREFIXES = {'approve': 'approve', 'delete': 'delete', 'reply': 'reply'}
+
+
+def cb(action, value=None):
+    """Собирает callback_data для кнопки"""
+    if value is None:
+        return action
+    return f"{action}{SEPARATOR}{int(value)}"
+
+
+def decode(data):
+    """callback_data -> (действие, число или None). None для неизвестного формата"""
+    action, separator, value = data.partition(SEPARATOR)
+    if separator:
+        return (action, int(value)) if value.isdigit() else None
+    legacy = LEGACY_EXACT.get(data)
+    if legacy:
+        return legacy
+    prefix, _, value = data.rpartition('_')
+    if prefix in LEGACY_PREFIXES and value.isdigit():
+        return LEGACY_PREFIXES[prefix], int(value)
+    return action, None
+
+
+class CallbackRouter:
+    """Маршрутизация callback-ов по словарю вместо цепочки фильтров.
+
+    Один обработчик aiogram разбирает callback_data и за один поиск в
+    словаре находит нужную функцию; число из данных передается в нее уже
+    как int под именем, заданным при регистрации.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self.fallback = None
+
+    def route(self, action, value_name=None):
+        def decorator(handler):
+            # Какие аргументы принимает обработчик - выясняем один раз здесь
+            accepts_state = 'state' in inspect.signature(handler).parameters
+            self._routes[action] = (handler, value_name, accepts_state)
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """(обработчик, kwargs) для callback_data или (None, None)"""
+        decoded = decode(data or '')
+        if decoded is None:
+            return None, None
+        action, value = decoded
+        entry = self._routes.get(action)
+        if entry is None:
+            return None, None
+        value_name = entry[1]
+        if value_name is not None:
+            if value is None:
+                return None, None
+            return entry, {value_name: value}
+        return entry, {}
+
+    async def dispatch(self, callback, state):
+        entry, kwargs = self.resolve(callback.data)
+        if entry is None:
+            return await self.fallback(callback)
+        handler, _, accepts_state = entry
+        if accepts_state:
+            kwargs['state'] = state
+        token = log_context.set({**log_context.get(), 'handler': handler.__name__})
+        try:
+            return await handler(callback, **kwargs)
+        finally:
+            log_context.reset(token)
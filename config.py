@@ -18,4 +18,78 @@ ADMIN_IDS = [5623324059]  # Ваш ID из вывода
 # Настройки платежей
 PAYMENT_METHODS = {
     'sber': '2202 2082 6210 7460'
-}
\ No newline at end of file
+}
+
+# Сколько последних update_id / callback id помнить для отсева дублей
+DEDUP_CACHE_SIZE = 10000
+
+# Сколько секунд платеж закреплен за администратором после /next или нажатия кнопки
+CLAIM_LEASE_SECONDS = 600
+
+# Ограничения исходящих сообщений (Telegram допускает ~30 сообщений в секунду на бота)
+SEND_RATE_PER_SECOND = 25
+SEND_CONCURRENCY = 10
+# Общий потолок для всех ботов процесса (None - без него, у каждого бота свой лимит)
+SEND_GLOBAL_RATE_PER_SECOND = None
+
+# Логирование: JSON-строки в stdout и в файл с ротацией по размеру
+LOG_LEVEL = 'INFO'
+LOG_FILE = 'bot.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Доля INFO-записей, которые пишутся для шумных логгеров (1.0 - все)
+LOG_SAMPLE_RATES = {
+    'aiogram.event': 0.1,
+}
+
+# Резервные копии keys.db (SQLite online backup, без остановки бота)
+BACKUP_DIR = 'backups'
+BACKUP_INTERVAL_SECONDS = 6 * 60 * 60
+BACKUP_KEEP = 14
+# Страниц за шаг и пауза между шагами - чем меньше шаг, тем короче блокировки
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.05
+
+# Как часто досчитывать дневную статистику для /stats
+STATS_ROLLUP_INTERVAL_SECONDS = 5 * 60
+
+# Автоматические конфиги WireGuard для выданных ключей.
+# Пустой WG_SERVER_PUBLIC_KEY - генерация выключена.
+WG_SERVER_PUBLIC_KEY = os.getenv('WG_SERVER_PUBLIC_KEY', '')
+WG_ENDPOINT = os.getenv('WG_ENDPOINT', 'vpn.example.com:51820')
+WG_DNS = '1.1.1.1'
+WG_ALLOWED_IPS = '0.0.0.0/0, ::/0'
+# Сеть клиентов: .1 - сервер, клиентам адреса по id ключа
+WG_CLIENT_NETWORK = '10.8.0.0/16'
+WG_CACHE_DIR = 'wg_configs'
+# Процессов для генерации ключей, конфигов и QR (None - по числу CPU)
+WG_POOL_WORKERS = None
+
+# Запись входящих апдейтов (с анонимными ID) для replay.py. По умолчанию выключена.
+RECORD_UPDATES = os.getenv('RECORD_UPDATES', '') == '1'
+RECORD_DIR = 'recordings'
+
+# Боты, которые обслуживает один процесс: у каждого свой токен, база и администраторы.
+# Если ботов несколько, 'db' обязателен и у каждого свой файл.
+# Общие: event loop, HTTP-сессия, хранилище FSM, пул процессов. Лимит отправки - у каждого свой.
+# wireguard - свой сервер или своя сеть клиентов: id ключей у ботов независимые,
+# поэтому два бота на одном сервере с общей сетью выдали бы одинаковые адреса
+# (такая конфигурация не запустится). Без wireguard генерация конфигов выключена.
+BOTS = [
+    {
+        'name': 'main',
+        'token': BOT_TOKEN,
+        'db': 'keys.db',
+        'admin_ids': ADMIN_IDS,
+        'wireguard': {
+            'server_public_key': WG_SERVER_PUBLIC_KEY,
+            'endpoint': WG_ENDPOINT,
+            'dns': WG_DNS,
+            'allowed_ips': WG_ALLOWED_IPS,
+            'client_network': WG_CLIENT_NETWORK,
+        },
+    },
+]
+
+# Кто видит нагрузку всех ботов (/tenants)
+HOST_ADMIN_IDS = ADMIN_IDS
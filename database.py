@@ -1,14 +1,45 @@
+import logging
+import math
 import sqlite3
 import threading
 from datetime import datetime, timedelta
 from contextlib import contextmanager
 
+logger = logging.getLogger(__name__)
+
+
+class PaymentConflictError(Exception):
+    """Платеж уже обработан или забронирован другим администратором"""
+    
+    def __init__(self, payment_id):
+        super().__init__(f"Платеж {payment_id} уже обработан или занят")
+        self.payment_id = payment_id
+
+
 class Database:
-    def __init__(self, db_name='keys.db'):
+    def __init__(self, db_name='keys.db', lazy=False):
         self.db_name = db_name
         self._local = threading.local()
-        self.create_tables()
-        self.upgrade_tables()  # Добавляем обновление таблиц
+        self._ready = threading.Event()
+        self._prepare_lock = threading.RLock()
+        self._preparing = False
+        if not lazy:
+            self.prepare()
+    
+    def prepare(self):
+        """Создание и обновление таблиц. При lazy=True - при первом запросе
+        или заранее из фонового потока (bot.py делает это параллельно с поллингом)"""
+        with self._prepare_lock:
+            # _preparing видит только поток, который уже держит блокировку
+            if self._ready.is_set() or self._preparing:
+                return
+            self._preparing = True
+            try:
+                self.create_tables()
+                self.upgrade_tables()  # Добавляем обновление таблиц
+                self._ready.set()
+            finally:
+                self._preparing = False
     
     @property
     def conn(self):
@@ -19,6 +50,8 @@ class Database:
     
     @contextmanager
     def get_cursor(self):
+        if not self._ready.is_set():
+            self.prepare()
         cursor = self.conn.cursor()
         try:
             yield cursor
@@ -49,6 +82,7 @@ class Database:
                     key TEXT,
                     duration INTEGER,
                     config_url TEXT,
+                    wg_public_key TEXT,
                     is_active BOOLEAN DEFAULT 1,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     expires_at TIMESTAMP,
@@ -66,25 +100,109 @@ class Database:
                     proof_photo_id TEXT,
                     status TEXT DEFAULT 'pending',
                     admin_key TEXT,
+                    claimed_by INTEGER,
+                    claim_expires_at TIMESTAMP,
+                    reviewed_by INTEGER,
+                    reviewed_at TIMESTAMP,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users (user_id)
                 )
             ''')
+            
+            # Исходящие сообщения пользователям (transactional outbox)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER,
+                    text TEXT,
+                    kind TEXT DEFAULT 'text',
+                    file_path TEXT,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    sent_at TIMESTAMP
+                )
+            ''')
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)"
+            )
+            
+            # Дневные агрегаты для /stats (день в UTC, как CURRENT_TIMESTAMP)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS daily_stats (
+                    day TEXT PRIMARY KEY,
+                    new_users INTEGER DEFAULT 0,
+                    payments_submitted INTEGER DEFAULT 0,
+                    payments_approved INTEGER DEFAULT 0,
+                    revenue REAL DEFAULT 0,
+                    median_approval_seconds REAL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS daily_revenue (
+                    day TEXT,
+                    duration INTEGER,
+                    approved INTEGER DEFAULT 0,
+                    revenue REAL DEFAULT 0,
+                    PRIMARY KEY (day, duration)
+                )
+            ''')
+            # Гистограмма времени подтверждения по дням: складывается за любой
+            # период, из нее считается медиана за 7/30/365 дней
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS daily_approval_times (
+                    day TEXT,
+                    bucket INTEGER,
+                    count INTEGER DEFAULT 0,
+                    PRIMARY KEY (day, bucket)
+                )
+            ''')
+            # Водяные знаки инкрементального пересчета
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rollup_state (
+                    name TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+    
+    # Колонки, добавленные после первой версии схемы: (таблица, колонка, тип)
+    UPGRADE_COLUMNS = [
+        ('payments', 'admin_key', 'TEXT'),
+        ('payments', 'claimed_by', 'INTEGER'),
+        ('payments', 'claim_expires_at', 'TIMESTAMP'),
+        ('payments', 'reviewed_by', 'INTEGER'),
+        ('payments', 'reviewed_at', 'TIMESTAMP'),
+        ('outbox', 'kind', "TEXT DEFAULT 'text'"),
+        ('outbox', 'file_path', 'TEXT'),
+        ('keys', 'wg_public_key', 'TEXT'),
+    ]
     
     def upgrade_tables(self):
         """Обновление структуры таблиц если они устарели"""
         with self.get_cursor() as cursor:
-            # Проверяем есть ли колонка admin_key в таблице payments
-            try:
-                cursor.execute("SELECT admin_key FROM payments LIMIT 1")
-            except sqlite3.OperationalError:
-                # Колонки нет, нужно добавить
-                print("⚠️ Обновляю структуру базы данных...")
+            for table, column, column_type in self.UPGRADE_COLUMNS:
+                # Проверяем есть ли колонка в таблице
                 try:
-                    cursor.execute("ALTER TABLE payments ADD COLUMN admin_key TEXT")
-                    print("✅ Колонка admin_key добавлена")
-                except Exception as e:
-                    print(f"❌ Ошибка при обновлении базы: {e}")
+                    cursor.execute(f"SELECT {column} FROM {table} LIMIT 1")
+                except sqlite3.OperationalError:
+                    # Колонки нет, нужно добавить
+                    logger.warning("⚠️ Обновляю структуру базы данных...")
+                    try:
+                        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                        logger.info(f"✅ Колонка {column} добавлена")
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка при обновлении базы: {e}")
+            
+            # Индекс для очереди проверки платежей
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_payments_status ON payments (status, id)"
+            )
+            # Индекс для пересчета дневной статистики по подтверждениям
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_payments_reviewed ON payments (reviewed_at)"
+            )
     
     def add_user(self, user_id, username):
         with self.get_cursor() as cursor:
@@ -93,31 +211,308 @@ class Database:
                 (user_id, username)
             )
     
-    def add_key(self, user_id, key, duration, config_url=""):
+    def add_payment(self, user_id, amount, duration, proof_photo_id):
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                '''INSERT INTO payments (user_id, amount, duration, proof_photo_id) 
+                   VALUES (?, ?, ?, ?)''',
+                (user_id, amount, duration, proof_photo_id)
+            )
+            return cursor.lastrowid
+    
+    # Условие "платеж свободен или уже забронирован этим администратором".
+    # Бронь с истекшим сроком считается свободной - так платеж сам
+    # возвращается в очередь.
+    _CLAIMABLE = (
+        "(claimed_by IS NULL OR claimed_by = ? "
+        "OR claim_expires_at <= CURRENT_TIMESTAMP)"
+    )
+    
+    def issue_key(self, payment_id, user_id, key, duration, config_url="", admin_id=None,
+                  notification=None):
+        """Подтверждает платеж и добавляет ключ одной транзакцией.
+        
+        Возвращает False, если платеж уже не в статусе pending (двойное
+        нажатие или другой администратор успел раньше) или его держит
+        чужая активная бронь - тогда ничего не пишется. Иначе возвращает id
+        нового ключа. Текст notification кладется в outbox в той же транзакции.
+        config_url=None означает, что конфиг WireGuard еще будет собран.
+        """
         expires_at = datetime.now() + timedelta(days=duration)
         with self.get_cursor() as cursor:
+            cursor.execute(
+                f'''UPDATE payments
+                   SET status = 'approved', admin_key = ?, reviewed_by = ?,
+                       reviewed_at = CURRENT_TIMESTAMP,
+                       claimed_by = NULL, claim_expires_at = NULL
+                   WHERE id = ? AND status = 'pending' AND {self._CLAIMABLE}''',
+                (key, admin_id, payment_id, admin_id)
+            )
+            if cursor.rowcount == 0:
+                return False
             cursor.execute(
                 '''INSERT INTO keys (user_id, key, duration, config_url, expires_at) 
                    VALUES (?, ?, ?, ?, ?)''',
                 (user_id, key, duration, config_url, expires_at.strftime('%Y-%m-%d %H:%M:%S'))
             )
+            key_id = cursor.lastrowid
+            if notification:
+                self._add_outbox(cursor, user_id, notification)
+            return key_id
     
-    def add_payment(self, user_id, amount, duration, proof_photo_id):
+    def claim_payment(self, payment_id, admin_id, lease_seconds):
+        """Бронирует (или продлевает) pending-платеж за администратором"""
         with self.get_cursor() as cursor:
             cursor.execute(
-                '''INSERT INTO payments (user_id, amount, duration, proof_photo_id) 
-                   VALUES (?, ?, ?, ?)''',
-                (user_id, amount, duration, proof_photo_id)
+                f'''UPDATE payments
+                   SET claimed_by = ?, claim_expires_at = datetime('now', ?)
+                   WHERE id = ? AND status = 'pending' AND {self._CLAIMABLE}''',
+                (admin_id, f'+{int(lease_seconds)} seconds', payment_id, admin_id)
             )
-            return cursor.lastrowid
+            return cursor.rowcount > 0
+    
+    def claim_next_payment(self, admin_id, lease_seconds):
+        """Выдает администратору самый старый свободный pending-платеж.
+        
+        Если у администратора уже есть активная бронь, возвращается она.
+        None - очередь пуста.
+        """
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                '''SELECT id FROM payments
+                   WHERE status = 'pending' AND claimed_by = ?
+                     AND claim_expires_at > CURRENT_TIMESTAMP
+                   ORDER BY id LIMIT 1''',
+                (admin_id,)
+            )
+            row = cursor.fetchone()
+            while row is None:
+                cursor.execute(
+                    '''SELECT id FROM payments
+                       WHERE status = 'pending'
+                         AND (claimed_by IS NULL OR claim_expires_at <= CURRENT_TIMESTAMP)
+                       ORDER BY id LIMIT 1'''
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                # Другой администратор мог успеть раньше - тогда берем следующий
+                cursor.execute(
+                    '''UPDATE payments
+                       SET claimed_by = ?, claim_expires_at = datetime('now', ?)
+                       WHERE id = ? AND status = 'pending'
+                         AND (claimed_by IS NULL OR claim_expires_at <= CURRENT_TIMESTAMP)''',
+                    (admin_id, f'+{int(lease_seconds)} seconds', row['id'])
+                )
+                if cursor.rowcount == 0:
+                    row = None
+            payment_id = row['id']
+        return self.get_payment_by_id(payment_id)
+    
+    def issue_keys_bulk(self, assignments, admin_id):
+        """Массовая выдача ключей одной транзакцией.
+        
+        assignments - список словарей с payment_id, user_id, key, duration
+        и необязательными notification (текст в outbox) и config_url. id
+        созданного ключа записывается в item['key_id']. Если хотя бы один платеж уже не pending или занят чужой бронью,
+        откатывается вся пачка и выбрасывается PaymentConflictError.
+        """
+        with self.get_cursor() as cursor:
+            for item in assignments:
+                cursor.execute(
+                    f'''UPDATE payments
+                       SET status = 'approved', admin_key = ?, reviewed_by = ?,
+                           reviewed_at = CURRENT_TIMESTAMP,
+                           claimed_by = NULL, claim_expires_at = NULL
+                       WHERE id = ? AND status = 'pending' AND {self._CLAIMABLE}''',
+                    (item['key'], admin_id, item['payment_id'], admin_id)
+                )
+                if cursor.rowcount == 0:
+                    raise PaymentConflictError(item['payment_id'])
+                expires_at = datetime.now() + timedelta(days=item['duration'])
+                cursor.execute(
+                    '''INSERT INTO keys (user_id, key, duration, config_url, expires_at) 
+                       VALUES (?, ?, ?, ?, ?)''',
+                    (item['user_id'], item['key'], item['duration'], item.get('config_url', ""),
+                     expires_at.strftime('%Y-%m-%d %H:%M:%S'))
+                )
+                item['key_id'] = cursor.lastrowid
+                if item.get('notification'):
+                    self._add_outbox(cursor, item['user_id'], item['notification'])
+    
+    # Сколько параметров подставлять в один IN (...) - у SQLite есть лимит
+    IN_CHUNK_SIZE = 500
+    
+    def get_claimable_payments(self, payment_ids, admin_id):
+        """Pending-платежи из списка, которые может взять администратор: {id: платеж}"""
+        result = {}
+        payment_ids = list(payment_ids)
+        with self.get_cursor() as cursor:
+            for start in range(0, len(payment_ids), self.IN_CHUNK_SIZE):
+                chunk = payment_ids[start:start + self.IN_CHUNK_SIZE]
+                placeholders = ", ".join("?" for _ in chunk)
+                cursor.execute(
+                    f'''SELECT id, user_id, amount, duration FROM payments
+                       WHERE id IN ({placeholders}) AND status = 'pending' AND {self._CLAIMABLE}''',
+                    (*chunk, admin_id)
+                )
+                result.update({row['id']: dict(row) for row in cursor.fetchall()})
+        return result
+    
+    def get_oldest_claimable_payments(self, duration, limit, admin_id):
+        """Самые старые pending-платежи с нужным сроком, доступные администратору"""
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                f'''SELECT id, user_id, amount, duration FROM payments
+                   WHERE status = 'pending' AND duration = ? AND {self._CLAIMABLE}
+                   ORDER BY id LIMIT ?''',
+                (duration, admin_id, limit)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def get_existing_keys(self, keys):
+        """Какие из ключей уже выданы"""
+        result = set()
+        keys = list(keys)
+        with self.get_cursor() as cursor:
+            for start in range(0, len(keys), self.IN_CHUNK_SIZE):
+                chunk = keys[start:start + self.IN_CHUNK_SIZE]
+                placeholders = ", ".join("?" for _ in chunk)
+                cursor.execute(f"SELECT key FROM keys WHERE key IN ({placeholders})", chunk)
+                result.update(row['key'] for row in cursor.fetchall())
+        return result
+    
+    def release_claim(self, payment_id, admin_id):
+        """Снимает бронь администратора, платеж возвращается в очередь"""
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                "UPDATE payments SET claimed_by = NULL, claim_expires_at = NULL "
+                "WHERE id = ? AND claimed_by = ?",
+                (payment_id, admin_id)
+            )
+            return cursor.rowcount > 0
     
-    def update_payment_with_key(self, payment_id, key):
+    def get_queue_stats(self):
+        """Глубина очереди: свободные и забронированные pending-платежи"""
+        with self.get_cursor() as cursor:
+            cursor.execute('''
+                SELECT
+                    SUM(CASE WHEN claimed_by IS NULL OR claim_expires_at <= CURRENT_TIMESTAMP
+                             THEN 1 ELSE 0 END) AS queued,
+                    SUM(CASE WHEN claimed_by IS NOT NULL AND claim_expires_at > CURRENT_TIMESTAMP
+                             THEN 1 ELSE 0 END) AS claimed
+                FROM payments WHERE status = 'pending'
+            ''')
+            row = cursor.fetchone()
+            return {'queued': row['queued'] or 0, 'claimed': row['claimed'] or 0}
+    
+    def get_admin_stats(self):
+        """Сколько платежей подтвердил каждый администратор (всего и за сутки)"""
+        with self.get_cursor() as cursor:
+            cursor.execute('''
+                SELECT reviewed_by AS admin_id,
+                       COUNT(*) AS total,
+                       SUM(CASE WHEN reviewed_at > datetime('now', '-1 day')
+                                THEN 1 ELSE 0 END) AS last_day
+                FROM payments
+                WHERE reviewed_by IS NOT NULL
+                GROUP BY reviewed_by
+                ORDER BY total DESC
+            ''')
+            rows = cursor.fetchall()
+            return [dict(row) for row in rows]
+    
+    def _add_outbox(self, cursor, chat_id, text, kind='text', file_path=None):
+        cursor.execute(
+            "INSERT INTO outbox (chat_id, text, kind, file_path) VALUES (?, ?, ?, ?)",
+            (chat_id, text, kind, file_path)
+        )
+        return cursor.lastrowid
+    
+    def add_outbox_message(self, chat_id, text):
+        """Ставит сообщение пользователю в очередь отправки"""
+        with self.get_cursor() as cursor:
+            return self._add_outbox(cursor, chat_id, text)
+    
+    def get_due_outbox(self, limit):
+        """Сообщения, которые пора отправить (самые старые первыми)"""
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                '''SELECT id, chat_id, text, kind, file_path, attempts FROM outbox
+                   WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                   ORDER BY id LIMIT ?''',
+                (limit,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def mark_outbox_sent(self, message_id):
         with self.get_cursor() as cursor:
             cursor.execute(
-                "UPDATE payments SET status = 'approved', admin_key = ? WHERE id = ?",
-                (key, payment_id)
+                "UPDATE outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (message_id,)
             )
     
+    def reschedule_outbox(self, message_id, delay_seconds, error, count_attempt=True):
+        """Откладывает повторную отправку на delay_seconds"""
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                '''UPDATE outbox
+                   SET attempts = attempts + ?, last_error = ?,
+                       next_attempt_at = datetime('now', ?)
+                   WHERE id = ?''',
+                (1 if count_attempt else 0, error, f'+{int(delay_seconds)} seconds', message_id)
+            )
+    
+    def mark_outbox_dead(self, message_id, error):
+        """Окончательная ошибка доставки (dead letter)"""
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                "UPDATE outbox SET status = 'dead', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                (error, message_id)
+            )
+    
+    def get_outbox_stats(self):
+        """Количество сообщений outbox по статусам"""
+        with self.get_cursor() as cursor:
+            cursor.execute("SELECT status, COUNT(*) AS count FROM outbox GROUP BY status")
+            stats = {'pending': 0, 'sent': 0, 'dead': 0}
+            stats.update({row['status']: row['count'] for row in cursor.fetchall()})
+            return stats
+    
+    def set_key_config(self, key_id, config_url, messages=(), public_key=None):
+        """Сохраняет путь к конфигу ключа и кладет сообщения в outbox одной транзакцией.
+        
+        messages - словари с chat_id, text, kind и file_path. Срабатывает
+        только для ключа, конфиг которого еще не сохранен; иначе (конфиг
+        уже собрала параллельная задача) возвращает False и ничего не пишет.
+        """
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                "UPDATE keys SET config_url = ?, wg_public_key = ? WHERE id = ? AND config_url IS NULL",
+                (config_url, public_key, key_id)
+            )
+            if cursor.rowcount == 0:
+                return False
+            for message in messages:
+                self._add_outbox(
+                    cursor, message['chat_id'], message['text'],
+                    message.get('kind', 'text'), message.get('file_path')
+                )
+            return True
+    
+    def get_key_public_key(self, key_id):
+        """Публичный ключ WireGuard, сохраненный для ключа, или None"""
+        with self.get_cursor() as cursor:
+            cursor.execute("SELECT wg_public_key FROM keys WHERE id = ?", (key_id,))
+            row = cursor.fetchone()
+            return row['wg_public_key'] if row else None
+    
+    def get_keys_pending_config(self):
+        """Ключи, для которых конфиг WireGuard заказан, но еще не собран"""
+        with self.get_cursor() as cursor:
+            cursor.execute("SELECT id, user_id FROM keys WHERE config_url IS NULL ORDER BY id")
+            return [dict(row) for row in cursor.fetchall()]
+    
     def get_user_keys(self, user_id):
         with self.get_cursor() as cursor:
             cursor.execute(
@@ -155,9 +550,13 @@ class Database:
                 return dict(row)
             return None
     
-    def delete_payment(self, payment_id):
+    def delete_payment(self, payment_id, admin_id=None):
+        """Удаляет платеж. Pending-платеж под чужой активной бронью не удаляется"""
         with self.get_cursor() as cursor:
-            cursor.execute("DELETE FROM payments WHERE id = ?", (payment_id,))
+            cursor.execute(
+                f"DELETE FROM payments WHERE id = ? AND (status != 'pending' OR {self._CLAIMABLE})",
+                (payment_id, admin_id)
+            )
             return cursor.rowcount > 0
     
     def get_all_payments(self):
@@ -171,6 +570,210 @@ class Database:
             rows = cursor.fetchall()
             return [dict(row) for row in rows]
     
+    # Корзины гистограммы растут в 1.1 раза: медиана по ним точна до ~5%
+    APPROVAL_BUCKET_GROWTH = 1.1
+    
+    def _approval_bucket(self, seconds):
+        if seconds is None or seconds < 1:
+            return 0
+        return int(math.log(seconds) / math.log(self.APPROVAL_BUCKET_GROWTH)) + 1
+    
+    def _approval_bucket_seconds(self, bucket):
+        """Середина корзины (геометрическая) в секундах"""
+        if bucket == 0:
+            return 0.5
+        return self.APPROVAL_BUCKET_GROWTH ** (bucket - 0.5)
+    
+    def _histogram_median(self, buckets):
+        """Медиана по строкам (bucket, count), отсортированным по bucket"""
+        total = sum(row['count'] for row in buckets)
+        seen = 0
+        for row in buckets:
+            seen += row['count']
+            if seen * 2 >= total:
+                return self._approval_bucket_seconds(row['bucket'])
+        return None
+    
+    def _add_approval_times(self, cursor, reviewed_after, reviewed_until):
+        """Раскладывает подтверждения из (reviewed_after, reviewed_until] по корзинам"""
+        cursor.execute(
+            '''SELECT date(reviewed_at) AS day,
+                      (julianday(reviewed_at) - julianday(created_at)) * 86400 AS seconds
+               FROM payments
+               WHERE status = 'approved' AND reviewed_at > ? AND reviewed_at <= ?''',
+            (reviewed_after, reviewed_until)
+        )
+        counts = {}
+        for row in cursor.fetchall():
+            key = (row['day'], self._approval_bucket(row['seconds']))
+            counts[key] = counts.get(key, 0) + 1
+        cursor.executemany(
+            '''INSERT INTO daily_approval_times (day, bucket, count) VALUES (?, ?, ?)
+               ON CONFLICT(day, bucket) DO UPDATE SET count = count + excluded.count''',
+            [(day, bucket, count) for (day, bucket), count in counts.items()]
+        )
+    
+    def rollup_daily_stats(self):
+        """Досчитывает daily_stats / daily_revenue по строкам после водяных знаков.
+        
+        Новые пользователи и платежи отслеживаются по id, подтверждения - по
+        reviewed_at. Время подтверждения раскладывается по гистограмме дня,
+        из нее же берется дневная медиана. Возвращает число обработанных строк.
+        """
+        with self.get_cursor() as cursor:
+            # Сразу берем блокировку записи: два одновременных пересчета
+            # не должны прочитать один и тот же водяной знак
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT name, value FROM rollup_state")
+            state = {row['name']: row['value'] for row in cursor.fetchall()}
+            last_user_id = int(state.get('users_id', 0))
+            last_payment_id = int(state.get('payments_id', 0))
+            last_reviewed_at = state.get('reviewed_at')
+            
+            # Верхние границы фиксируем заранее: то, что появится во время
+            # пересчета, попадет в следующий запуск. Подтверждения текущей
+            # секунды откладываем, чтобы не потерять их на границе.
+            cursor.execute('''
+                SELECT (SELECT IFNULL(MAX(id), 0) FROM users) AS max_user_id,
+                       (SELECT IFNULL(MAX(id), 0) FROM payments) AS max_payment_id,
+                       datetime('now', '-1 seconds') AS reviewed_cutoff
+            ''')
+            bounds = cursor.fetchone()
+            processed = 0
+            
+            cursor.execute(
+                '''SELECT date(registration_date) AS day, COUNT(*) AS count FROM users
+                   WHERE id > ? AND id <= ? GROUP BY day''',
+                (last_user_id, bounds['max_user_id'])
+            )
+            for row in cursor.fetchall():
+                processed += row['count']
+                cursor.execute(
+                    '''INSERT INTO daily_stats (day, new_users) VALUES (?, ?)
+                       ON CONFLICT(day) DO UPDATE SET new_users = new_users + excluded.new_users''',
+                    (row['day'], row['count'])
+                )
+            
+            cursor.execute(
+                '''SELECT date(created_at) AS day, COUNT(*) AS count FROM payments
+                   WHERE id > ? AND id <= ? GROUP BY day''',
+                (last_payment_id, bounds['max_payment_id'])
+            )
+            for row in cursor.fetchall():
+                processed += row['count']
+                cursor.execute(
+                    '''INSERT INTO daily_stats (day, payments_submitted) VALUES (?, ?)
+                       ON CONFLICT(day) DO UPDATE
+                       SET payments_submitted = payments_submitted + excluded.payments_submitted''',
+                    (row['day'], row['count'])
+                )
+            
+            approvals_query = '''
+                SELECT date(reviewed_at) AS day, duration, COUNT(*) AS count, SUM(amount) AS revenue
+                FROM payments
+                WHERE status = 'approved' AND reviewed_at > ? AND reviewed_at <= ?
+                GROUP BY day, duration
+            '''
+            params = (last_reviewed_at or '', bounds['reviewed_cutoff'])
+            if last_reviewed_at is None:
+                # Первый запуск: платежи, подтвержденные до появления
+                # reviewed_at, считаем по дню создания (без времени подтверждения)
+                approvals_query += '''
+                UNION ALL
+                SELECT date(created_at) AS day, duration, COUNT(*) AS count, SUM(amount) AS revenue
+                FROM payments
+                WHERE status = 'approved' AND reviewed_at IS NULL
+                GROUP BY day, duration
+                '''
+            cursor.execute(approvals_query, params)
+            touched_days = set()
+            for row in cursor.fetchall():
+                processed += row['count']
+                touched_days.add(row['day'])
+                cursor.execute(
+                    '''INSERT INTO daily_stats (day, payments_approved, revenue) VALUES (?, ?, ?)
+                       ON CONFLICT(day) DO UPDATE
+                       SET payments_approved = payments_approved + excluded.payments_approved,
+                           revenue = revenue + excluded.revenue''',
+                    (row['day'], row['count'], row['revenue'])
+                )
+                cursor.execute(
+                    '''INSERT INTO daily_revenue (day, duration, approved, revenue) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(day, duration) DO UPDATE
+                       SET approved = approved + excluded.approved,
+                           revenue = revenue + excluded.revenue''',
+                    (row['day'], row['duration'], row['count'], row['revenue'])
+                )
+            
+            # Гистограмма заведена позже водяного знака: один раз досчитываем
+            # подтверждения, уже учтенные в прошлых пересчетах
+            if 'approval_times' not in state and last_reviewed_at:
+                self._add_approval_times(cursor, '', last_reviewed_at)
+            self._add_approval_times(cursor, last_reviewed_at or '', bounds['reviewed_cutoff'])
+            
+            # Дневная медиана - по гистограмме дня, без повторного чтения платежей
+            for day in touched_days:
+                cursor.execute(
+                    "SELECT bucket, count FROM daily_approval_times WHERE day = ? ORDER BY bucket",
+                    (day,)
+                )
+                median = self._histogram_median(cursor.fetchall())
+                cursor.execute(
+                    "UPDATE daily_stats SET median_approval_seconds = ? WHERE day = ?",
+                    (median, day)
+                )
+            
+            cursor.executemany(
+                "INSERT OR REPLACE INTO rollup_state (name, value) VALUES (?, ?)",
+                [
+                    ('users_id', str(bounds['max_user_id'])),
+                    ('payments_id', str(bounds['max_payment_id'])),
+                    ('reviewed_at', bounds['reviewed_cutoff']),
+                    ('approval_times', '1'),
+                ]
+            )
+            return processed
+    
+    def get_stats_summary(self, days):
+        """Итоги за последние days дней по дневным агрегатам"""
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                '''SELECT IFNULL(SUM(new_users), 0) AS new_users,
+                          IFNULL(SUM(payments_submitted), 0) AS payments_submitted,
+                          IFNULL(SUM(payments_approved), 0) AS payments_approved,
+                          IFNULL(SUM(revenue), 0) AS revenue
+                   FROM daily_stats WHERE day > date('now', ?)''',
+                (f'-{int(days)} days',)
+            )
+            summary = dict(cursor.fetchone())
+            
+            # Медиана по всем подтверждениям периода (а не медиана дневных
+            # медиан): складываем дневные гистограммы и ищем середину
+            cursor.execute(
+                '''SELECT bucket, SUM(count) AS count FROM daily_approval_times
+                   WHERE day > date('now', ?) GROUP BY bucket ORDER BY bucket''',
+                (f'-{int(days)} days',)
+            )
+            summary['median_approval_seconds'] = self._histogram_median(cursor.fetchall())
+            
+            cursor.execute(
+                '''SELECT duration, SUM(approved) AS approved, SUM(revenue) AS revenue
+                   FROM daily_revenue WHERE day > date('now', ?)
+                   GROUP BY duration ORDER BY duration''',
+                (f'-{int(days)} days',)
+            )
+            summary['by_duration'] = [dict(row) for row in cursor.fetchall()]
+            return summary
+    
+    def get_daily_stats(self, days):
+        """Дневные агрегаты за последние days дней (для графика)"""
+        with self.get_cursor() as cursor:
+            cursor.execute(
+                "SELECT * FROM daily_stats WHERE day > date('now', ?) ORDER BY day",
+                (f'-{int(days)} days',)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    
     def get_user_count(self):
         with self.get_cursor() as cursor:
             cursor.execute("SELECT COUNT(*) as count FROM users")
@@ -0,0 +1,127 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+# Контекст текущего апдейта: update_id, user_id, handler.
+# Заполняется middleware и подмешивается в каждую запись лога.
+log_context = contextvars.ContextVar('log_context', default={})
+
+# Стандартные атрибуты LogRecord, которые не нужно дублировать в JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class ContextFilter(logging.Filter):
+    """Копирует поля log_context в запись.
+
+    Работает в потоке обработчика (до очереди), пока контекст апдейта доступен.
+    """
+
+    def filter(self, record):
+        for key, value in log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только долю INFO/DEBUG записей от шумных логгеров.
+
+    rates - {имя логгера: доля от 0 до 1}. Предупреждения и ошибки
+    проходят всегда.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        name = record.name
+        while name:
+            if name in self.rates:
+                return random.random() < self.rates[name]
+            name = name.rpartition('.')[0]
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не форматирует запись в потоке обработчика.
+
+    Стандартный prepare() вызывает format() (вместе с трейсбеком) в потоке
+    event loop и стирает exc_info. Здесь в потоке обработчика только
+    подставляются аргументы сообщения (они могут измениться позже), а
+    трейсбек форматирует JsonFormatter в потоке QueueListener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=logging.INFO, log_file=None, max_bytes=10 * 1024 * 1024,
+                  backup_count=5, sample_rates=None):
+    """Настраивает неблокирующее логирование.
+
+    Обработчики только кладут запись в очередь; форматирование и запись
+    в stdout / файл с ротацией по размеру идут в фоновом потоке
+    QueueListener. Возвращает запущенный listener.
+    """
+    formatter = JsonFormatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    def stop_listener():
+        # Дописываем оставшиеся в очереди записи, если listener еще работает
+        if listener._thread is not None:
+            listener.stop()
+
+    atexit.register(stop_listener)
+    return listener
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from logging_setup import log_context
+
+
+class RecentIds:
+    """Ограниченный LRU недавно обработанных идентификаторов"""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def add(self, item):
+        """Запоминает item. False если он уже встречался"""
+        if item in self._items:
+            self._items.move_to_end(item)
+            return False
+        self._items[item] = None
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        return True
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DedupMiddleware(BaseMiddleware):
+    """Отбрасывает повторно доставленные апдейты и callback-и.
+
+    Проверка идет до любых обращений к базе, поэтому дубликат стоит
+    одного поиска в словаре (для callback-а - плюс пустой answer).
+    """
+
+    def __init__(self, maxsize=10000):
+        self.recent = RecentIds(maxsize)
+        self.dropped = 0
+
+    async def __call__(self, handler, event: Update, data):
+        # update_id уникален только в пределах одного бота
+        bot_id = data['bot'].id
+        keys = [('update', bot_id, event.update_id)]
+        if event.callback_query:
+            keys.append(('callback', bot_id, event.callback_query.id))
+
+        if any(key in self.recent for key in keys):
+            self.dropped += 1
+            if event.callback_query:
+                # Иначе у администратора до таймаута крутится индикатор на кнопке
+                try:
+                    await data['bot'].answer_callback_query(event.callback_query.id)
+                except Exception:
+                    # Первая копия уже ответила или запрос устарел
+                    pass
+            return None
+        for key in keys:
+            self.recent.add(key)
+
+        return await handler(event, data)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Кладет update_id и user_id в контекст логов на время обработки апдейта"""
+
+    async def __call__(self, handler, event: Update, data):
+        user = data.get('event_from_user')
+        token = log_context.set({
+            'update_id': event.update_id,
+            'user_id': user.id if user else None,
+        })
+        try:
+            return await handler(event, data)
+        finally:
+            log_context.reset(token)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Добавляет в контекст логов имя выбранного обработчика.
+
+    Регистрируется как inner middleware у message / callback_query,
+    где aiogram уже знает, какой обработчик сработал.
+    """
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        if handler_object is None:
+            return await handler(event, data)
+        token = log_context.set({
+            **log_context.get(),
+            'handler': handler_object.callback.__name__,
+        })
+        try:
+            return await handler(event, data)
+        finally:
+            log_context.reset(token)
+
+
+class RecordingMiddleware(BaseMiddleware):
+    """Передает каждый входящий апдейт в UpdateRecorder (для replay.py)"""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    async def __call__(self, handler, event: Update, data):
+        self.recorder.record(event.model_dump(mode='json', by_alias=True, exclude_none=True))
+        return await handler(event, data)
+
+
+class StartupProfileMiddleware(BaseMiddleware):
+    """Отмечает в профиле запуска первый обработанный апдейт и пишет отчет"""
+
+    def __init__(self, profile, logger):
+        self.profile = profile
+        self.logger = logger
+
+    async def __call__(self, handler, event: Update, data):
+        try:
+            return await handler(event, data)
+        finally:
+            if self.profile.mark_first_update():
+                self.logger.info("Startup profile:\n" + self.profile.report())
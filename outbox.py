@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import random
+
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramRetryAfter
+)
+from aiogram.types import FSInputFile
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых повторять бессмысленно: бот заблокирован,
+# чат не найден, некорректный текст
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest, TelegramNotFound)
+
+
+class OutboxWorker:
+    """Фоновая доставка сообщений из таблицы outbox.
+
+    Обработчики только записывают сообщение в базу (вместе с изменением
+    состояния) и вызывают wake(). Воркер отправляет их параллельно через
+    RateLimiter бота, повторяет временные ошибки с экспоненциальной
+    задержкой и переводит окончательные в статус dead. Неотправленные
+    сообщения остаются в базе и досылаются после перезапуска.
+    """
+
+    def __init__(self, db, bot, limiter, concurrency=10, batch_size=100,
+                 poll_interval=5, max_attempts=8, base_delay=2, max_delay=3600):
+        self.db = db
+        self.bot = bot
+        self.limiter = limiter
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._running = False
+
+    def wake(self):
+        """Сообщает воркеру, что в outbox появились новые сообщения"""
+        self._wakeup.set()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+
+    async def run(self):
+        self._running = True
+        while self._running:
+            self._wakeup.clear()
+            try:
+                batch = self.db.get_due_outbox(self.batch_size)
+            except Exception as e:
+                logger.error(f"Error reading outbox: {e}")
+                batch = []
+
+            if batch:
+                results = await asyncio.gather(
+                    *(self._deliver(message) for message in batch), return_exceptions=True
+                )
+                for result in results:
+                    if isinstance(result, Exception):
+                        logger.error(f"Error delivering outbox message: {result}")
+                # Очередь не разобрана до конца - сразу берем следующую пачку.
+                # Если база не записала результаты, ждем, чтобы не переотправлять по кругу
+                if len(batch) == self.batch_size and all(result is True for result in results):
+                    continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, message):
+        kind = message.get('kind') or 'text'
+        if kind == 'document':
+            await self.bot.send_document(
+                chat_id=message['chat_id'],
+                document=FSInputFile(message['file_path']),
+                caption=message['text']
+            )
+        elif kind == 'photo':
+            await self.bot.send_photo(
+                chat_id=message['chat_id'],
+                photo=FSInputFile(message['file_path']),
+                caption=message['text']
+            )
+        else:
+            await self.bot.send_message(chat_id=message['chat_id'], text=message['text'])
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempts)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _deliver(self, message):
+        """Отправляет одно сообщение. False если не удалось записать результат в базу"""
+        async with self._semaphore:
+            await self.limiter.acquire()
+            try:
+                await self._send(message)
+            except TelegramRetryAfter as e:
+                # Флуд-контроль: ждем сколько сказал Telegram, попытку не засчитываем
+                self.limiter.pause(e.retry_after)
+                update = (self.db.reschedule_outbox, message['id'], e.retry_after, str(e), False)
+            except PERMANENT_ERRORS as e:
+                logger.error(f"Outbox message {message['id']} to {message['chat_id']} failed: {e}")
+                update = (self.db.mark_outbox_dead, message['id'], str(e))
+            except Exception as e:
+                attempts = message['attempts'] + 1
+                if attempts >= self.max_attempts:
+                    logger.error(
+                        f"Outbox message {message['id']} to {message['chat_id']} "
+                        f"gave up after {attempts} attempts: {e}"
+                    )
+                    update = (self.db.mark_outbox_dead, message['id'], str(e))
+                else:
+                    update = (self.db.reschedule_outbox, message['id'], self._backoff(attempts), str(e))
+            else:
+                update = (self.db.mark_outbox_sent, message['id'])
+
+            # Ошибка базы (busy, диск) не должна останавливать воркер: сообщение
+            # останется pending и будет обработано в следующем проходе
+            method, *args = update
+            try:
+                method(*args)
+            except Exception as e:
+                logger.error(f"Error updating outbox message {message['id']}: {e}")
+                return False
+            return True
@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Поля с Telegram ID пользователей и чатов
+_ID_FIELDS = {'id', 'user_id', 'chat_id'}
+# Объекты, у которых поле id - это пользователь или чат
+_PERSON_OBJECTS = {'from_user', 'from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat'}
+# Личные данные, которые не сохраняются
+_PERSONAL_FIELDS = {'username', 'first_name', 'last_name', 'phone_number', 'title', 'bio'}
+
+
+class Anonymizer:
+    """Стабильные псевдонимы для Telegram ID внутри одной записи.
+
+    Соль случайная для каждой записи, поэтому псевдонимы из разных
+    записей нельзя сопоставить между собой или с настоящими ID.
+    """
+
+    def __init__(self, salt=None):
+        self.salt = salt or os.urandom(16)
+
+    def anonymize_id(self, value):
+        if not isinstance(value, int):
+            return value
+        digest = hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()
+        # Положительные ID, как у пользователей; отрицательные - как у групп
+        pseudonym = int.from_bytes(digest[:5], 'big') + 1
+        return pseudonym if value > 0 else -pseudonym
+
+    def anonymize_text(self, text):
+        # Команды нужны для маршрутизации, остальной текст (включая ключи
+        # от администраторов) заменяется заглушкой той же длины
+        if text.startswith('/'):
+            return text
+        return 'x' * len(text)
+
+    def anonymize(self, data, person=False):
+        if isinstance(data, list):
+            return [self.anonymize(item) for item in data]
+        if not isinstance(data, dict):
+            return data
+        result = {}
+        for key, value in data.items():
+            if key in _PERSONAL_FIELDS and isinstance(value, str):
+                result[key] = 'user'
+            elif key in _ID_FIELDS and (person or key != 'id'):
+                result[key] = self.anonymize_id(value)
+            elif key in ('text', 'caption') and isinstance(value, str):
+                result[key] = self.anonymize_text(value)
+            else:
+                result[key] = self.anonymize(value, person=key in _PERSON_OBJECTS)
+        return result
+
+
+class UpdateRecorder:
+    """Запись входящих апдейтов в сжатый JSONL.
+
+    Обработчики только кладут апдейт в очередь; сериализация, сжатие и
+    запись на диск идут в фоновом потоке. Первая строка файла - meta с
+    псевдонимами администраторов, остальные - {"t": секунды от начала, "update": ...}.
+    """
+
+    def __init__(self, directory, admin_ids):
+        self.directory = directory
+        self.admin_ids = admin_ids
+        self.anonymizer = Anonymizer()
+        self.path = None
+        self.recorded = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._started = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(
+            self.directory, f"updates-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl.gz"
+        )
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._write_loop, name='update-recorder', daemon=True)
+        self._thread.start()
+        self._queue.put({
+            'type': 'meta',
+            'admin_ids': [self.anonymizer.anonymize_id(admin_id) for admin_id in self.admin_ids],
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+        })
+        logger.info(f"Recording updates to {self.path}")
+
+    def record(self, update_data):
+        """update_data - апдейт в виде словаря (model_dump)"""
+        if self._thread is None:
+            return
+        self._queue.put({'t': round(time.monotonic() - self._started, 4), 'update': update_data})
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _write_loop(self):
+        with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if 'update' in item:
+                    item['update'] = self.anonymizer.anonymize(item['update'])
+                    self.recorded += 1
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
@@ -0,0 +1,242 @@
+"""Воспроизведение записанного трафика (recordings/*.jsonl.gz) для сравнения сборок.
+
+Запускает обработчики bot.py на копии keys.db во временном каталоге,
+вместо Telegram API - фейковая сессия. Пример:
+
+    python replay.py recordings/updates-20260101-120000.jsonl.gz --speed 10
+    python replay.py rec.jsonl.gz --speed max --json new.json --baseline old.json
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import typing
+from collections import Counter, defaultdict
+from datetime import datetime
+
+# Таблицы, изменения в которых показываются в отчете
+REPORT_TABLES = ('users', 'payments', 'keys', 'outbox')
+
+
+def load_recording(path):
+    meta, items = {}, []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            item = json.loads(line)
+            if item.get('type') == 'meta':
+                meta = item
+            else:
+                items.append(item)
+    return meta, items
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def table_counts(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        counts = {}
+        for table in REPORT_TABLES:
+            try:
+                counts[table] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            except sqlite3.OperationalError:
+                counts[table] = 0
+        return counts
+    finally:
+        conn.close()
+
+
+def make_fake_session(latency):
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, File, Message, User
+
+    class FakeSession(BaseSession):
+        """Сессия без сети: отвечает правдоподобными объектами и считает вызовы"""
+
+        def __init__(self):
+            super().__init__()
+            self.calls = Counter()
+            self._message_id = 0
+
+        async def close(self):
+            pass
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls[type(method).__name__] += 1
+            if latency:
+                await asyncio.sleep(latency)
+
+            returning = method.__returning__
+            if typing.get_origin(returning) is typing.Union:
+                returning = typing.get_args(returning)[0]
+            if typing.get_origin(returning) is list:
+                return []
+            if returning is Message:
+                self._message_id += 1
+                chat_id = getattr(method, 'chat_id', None)
+                return Message(
+                    message_id=self._message_id,
+                    date=datetime.now(),
+                    chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type='private')
+                ).as_(bot)
+            if returning is User:
+                return User(id=1, is_bot=True, first_name='replay')
+            if returning is File:
+                return File(file_id=getattr(method, 'file_id', 'fake'), file_unique_id='fake',
+                            file_path='fake')
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536,
+                                 raise_for_status=True):
+            yield b''
+
+    return FakeSession()
+
+
+async def replay(app, meta, items, speed, latency):
+    from aiogram.types import Update
+
+    # Запись воспроизводится на первом боте процесса
+    tenant = app.tenants[0]
+    tenant.admin_ids.extend(meta.get('admin_ids', []))
+    session = make_fake_session(latency)
+    tenant.bot.session = session
+
+    latencies = defaultdict(list)
+    errors = Counter()
+    changes_before = tenant.db.conn.total_changes
+
+    async def feed(item):
+        update = Update.model_validate(item['update'], context={'bot': tenant.bot})
+        kind = update.event_type
+        started = time.perf_counter()
+        try:
+            await app.dp.feed_update(tenant.bot, update)
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        latencies[kind].append(time.perf_counter() - started)
+
+    tasks = []
+    started = time.perf_counter()
+    for item in items:
+        if speed:
+            # Сохраняем исходные интервалы между апдейтами, ускоренные в speed раз
+            delay = item['t'] / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(feed(item)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    if tenant.wg_configs:
+        await tenant.wg_configs.close()
+
+    all_latencies = sorted(value for values in latencies.values() for value in values)
+    report = {
+        'updates': len(items),
+        'elapsed_seconds': elapsed,
+        'throughput': len(items) / elapsed if elapsed else 0.0,
+        'latency_ms': {},
+        'db_changes': tenant.db.conn.total_changes - changes_before,
+        'api_calls': dict(session.calls),
+        'errors': dict(errors),
+    }
+    for kind, values in [('all', all_latencies)] + sorted(latencies.items()):
+        values = sorted(values)
+        report['latency_ms'][kind] = {
+            'count': len(values),
+            'p50': percentile(values, 50) * 1000,
+            'p90': percentile(values, 90) * 1000,
+            'p99': percentile(values, 99) * 1000,
+            'max': (values[-1] if values else 0.0) * 1000,
+        }
+    return report
+
+
+def print_report(report, baseline=None):
+    def delta(value, old):
+        if old is None or not old:
+            return ''
+        return f"  ({(value - old) / old * 100:+.1f}%)"
+
+    base_all = (baseline or {}).get('latency_ms', {}).get('all', {})
+    print(f"Апдейтов: {report['updates']}, за {report['elapsed_seconds']:.2f} с, "
+          f"{report['throughput']:.1f}/с"
+          f"{delta(report['throughput'], (baseline or {}).get('throughput'))}")
+    print(f"{'тип':<20}{'кол-во':>8}{'p50, мс':>10}{'p90, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for kind, stats in report['latency_ms'].items():
+        print(f"{kind:<20}{stats['count']:>8}{stats['p50']:>10.2f}{stats['p90']:>10.2f}"
+              f"{stats['p99']:>10.2f}{stats['max']:>10.2f}")
+    if base_all:
+        print(f"p50 к базе:{delta(report['latency_ms']['all']['p50'], base_all.get('p50'))}, "
+              f"p99 к базе:{delta(report['latency_ms']['all']['p99'], base_all.get('p99'))}")
+    print(f"Изменений в БД (обработчики): {report['db_changes']}"
+          f"{delta(report['db_changes'], (baseline or {}).get('db_changes'))}")
+    print(f"Прирост строк: {report['table_growth']}")
+    print(f"Вызовы API: {report['api_calls']}")
+    if report['errors']:
+        print(f"Ошибки: {report['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов")
+    parser.add_argument('recording', help="файл recordings/updates-*.jsonl.gz")
+    parser.add_argument('--db', default='keys.db', help="база, копия которой используется")
+    parser.add_argument('--speed', default='1', help="1, N (ускорение) или max")
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help="искусственная задержка ответа Telegram API, мс")
+    parser.add_argument('--json', help="сохранить отчет в JSON")
+    parser.add_argument('--baseline', help="JSON-отчет прошлой сборки для сравнения")
+    args = parser.parse_args()
+
+    speed = None if args.speed == 'max' else float(args.speed)
+    recording = os.path.abspath(args.recording)
+    source_db = os.path.abspath(args.db)
+    json_path = os.path.abspath(args.json) if args.json else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    meta, items = load_recording(recording)
+
+    # bot.py открывает keys.db в текущем каталоге - подсовываем ему копию
+    workdir = tempfile.mkdtemp(prefix='replay-')
+    scratch_db = os.path.join(workdir, 'keys.db')
+    if os.path.exists(source_db):
+        from backup import _copy_online
+        _copy_online(source_db, scratch_db, pages=-1, step_sleep=0)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    os.environ['RECORD_UPDATES'] = ''
+
+    import bot as app
+    logging.getLogger().setLevel(logging.WARNING)
+
+    counts_before = table_counts(scratch_db)
+    report = asyncio.run(replay(app, meta, items, speed, args.api_latency / 1000))
+    counts_after = table_counts(scratch_db)
+    report['table_growth'] = {
+        table: counts_after[table] - counts_before[table] for table in REPORT_TABLES
+    }
+    report['scratch_dir'] = workdir
+
+    print_report(report, baseline)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
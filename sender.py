@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """Token bucket: не больше rate сообщений в секунду с запасом burst.
+
+    parent - общий ограничитель сверху (потолок для нескольких ботов);
+    pause() действует только на этот ограничитель, не на parent.
+    """
+
+    def __init__(self, rate, burst=None, parent=None):
+        self.rate = rate
+        self.parent = parent
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Останавливает отправку на seconds (ответ Telegram retry_after)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+        if self.parent is not None:
+            await self.parent.acquire()
+
@@ -0,0 +1,67 @@
+import time
+from contextlib import contextmanager
+
+# Импортируется первым в bot.py, поэтому отсчет идет почти от старта процесса
+_STARTED = time.perf_counter()
+
+
+class StartupProfile:
+    """Время фаз запуска бота: от импорта модулей до первого обработанного апдейта.
+
+    Фазы могут перекрываться (схема базы проверяется параллельно с первым
+    getUpdates), поэтому для каждой хранится и начало, и длительность.
+    """
+
+    def __init__(self, started=None):
+        self.started = _STARTED if started is None else started
+        self.phases = []
+        self.first_update = None
+        self._checkpoint = 0.0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def mark(self, name):
+        """Точка на шкале запуска без длительности"""
+        self.phases.append((name, self.elapsed(), 0.0))
+
+    def checkpoint(self, name):
+        """Последовательная фаза: от предыдущего checkpoint (или старта) до сейчас"""
+        now = self.elapsed()
+        self.phases.append((name, self._checkpoint, now - self._checkpoint))
+        self._checkpoint = now
+
+    @contextmanager
+    def phase(self, name):
+        start = self.elapsed()
+        try:
+            yield
+        finally:
+            self.phases.append((name, start, self.elapsed() - start))
+
+    def mark_first_update(self):
+        """Возвращает True только для первого апдейта"""
+        if self.first_update is not None:
+            return False
+        self.first_update = self.elapsed()
+        self.mark('first update')
+        return True
+
+    def as_dict(self):
+        return {
+            'phases': [
+                {'name': name, 'start_ms': start * 1000, 'duration_ms': duration * 1000}
+                for name, start, duration in self.phases
+            ],
+            'first_update_ms': None if self.first_update is None else self.first_update * 1000,
+        }
+
+    def report(self):
+        lines = [f"{'фаза':<28}{'начало, мс':>12}{'длит., мс':>12}"]
+        for name, start, duration in sorted(self.phases, key=lambda phase: phase[1]):
+            lines.append(f"{name:<28}{start * 1000:>12.1f}{duration * 1000:>12.1f}")
+        return '\n'.join(lines)
+
+
+# Профиль текущего процесса
+profile = StartupProfile()
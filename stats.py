@@ -0,0 +1,49 @@
+import asyncio
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def run_rollups(db, interval):
+    """Периодически досчитывает дневную статистику в фоновом потоке"""
+    while True:
+        try:
+            processed = await asyncio.to_thread(db.rollup_daily_stats)
+            if processed:
+                logger.info(f"Stats rollup processed {processed} rows")
+        except Exception as e:
+            logger.error(f"Error in stats rollup: {e}")
+        await asyncio.sleep(interval)
+
+
+def render_chart(rows):
+    """PNG-график выручки и подтверждений по дням.
+
+    matplotlib - необязательная зависимость; без нее выбрасывается ImportError.
+    Рисование занимает заметное время CPU, поэтому вызывать через
+    asyncio.to_thread.
+    """
+    # Figure без pyplot не трогает глобальное состояние и GUI-бэкенды
+    from matplotlib.figure import Figure
+
+    days = [row['day'][5:] for row in rows]
+    figure = Figure(figsize=(10, 5), dpi=100)
+    revenue_axis = figure.add_subplot()
+    revenue_axis.bar(days, [row['revenue'] for row in rows], color='#4c9be8', label='Выручка, руб')
+    revenue_axis.set_ylabel('Выручка, руб')
+    revenue_axis.tick_params(axis='x', labelrotation=60, labelsize=8)
+
+    count_axis = revenue_axis.twinx()
+    count_axis.plot(days, [row['payments_approved'] for row in rows], color='#e8754c',
+                    marker='o', label='Подтверждено')
+    count_axis.plot(days, [row['new_users'] for row in rows], color='#5cb85c',
+                    marker='.', label='Новые пользователи')
+    count_axis.set_ylabel('Количество')
+
+    figure.legend(loc='upper left')
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
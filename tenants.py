@@ -0,0 +1,115 @@
+import os
+import time
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from logging_setup import log_context
+
+# Бот (арендатор), чей апдейт сейчас обрабатывается
+current_tenant = ContextVar('current_tenant')
+
+
+def check_databases(bots):
+    """ValueError, если у ботов нет отдельных баз.
+
+    В outbox и других таблицах нет колонки бота: два бота на одной базе
+    отправляли бы каждое сообщение дважды, один раз чужим токеном.
+    """
+    if len(bots) > 1:
+        missing = [settings['name'] for settings in bots if not settings.get('db')]
+        if missing:
+            raise ValueError(f"Для нескольких ботов нужна своя база 'db', не задана у: {', '.join(missing)}")
+    seen = {}
+    for settings in bots:
+        path = os.path.realpath(settings.get('db', 'keys.db'))
+        if path in seen:
+            raise ValueError(f"Боты {seen[path]} и {settings['name']} используют одну базу {path}")
+        seen[path] = settings['name']
+
+
+class TenantMetrics:
+    """Нагрузка, которую создает один бот: апдейты, ошибки, время обработчиков"""
+
+    def __init__(self):
+        self.updates = 0
+        self.errors = 0
+        self.handler_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def observe(self, seconds, failed=False):
+        self.updates += 1
+        self.handler_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        if failed:
+            self.errors += 1
+
+
+class Tenant:
+    """Один бот в общем процессе: свой токен, база и администраторы"""
+
+    def __init__(self, name, bot, db, admin_ids, outbox, backups, wg_configs=None):
+        self.name = name
+        self.bot = bot
+        self.db = db
+        self.admin_ids = admin_ids
+        self.outbox = outbox
+        self.backups = backups
+        self.wg_configs = wg_configs
+        self.metrics = TenantMetrics()
+
+
+class TenantAttribute:
+    """Прокси к атрибуту текущего арендатора.
+
+    Позволяет обработчикам по-прежнему обращаться к модульным bot, db,
+    ADMIN_IDS, а получать объекты того бота, которому пришел апдейт.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def _target(self):
+        return getattr(current_tenant.get(), self._name)
+
+    def __getattr__(self, item):
+        return getattr(self._target(), item)
+
+    def __bool__(self):
+        return bool(self._target())
+
+    def __contains__(self, item):
+        return item in self._target()
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+    def __repr__(self):
+        return repr(self._target())
+
+
+class TenantMiddleware(BaseMiddleware):
+    """Выбирает арендатора по боту, принявшему апдейт, и считает его нагрузку"""
+
+    def __init__(self, tenants):
+        self.tenants = {tenant.bot.id: tenant for tenant in tenants}
+
+    async def __call__(self, handler, event: Update, data):
+        tenant = self.tenants[data['bot'].id]
+        tenant_token = current_tenant.set(tenant)
+        log_token = log_context.set({**log_context.get(), 'tenant': tenant.name})
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            tenant.metrics.observe(time.perf_counter() - started, failed)
+            log_context.reset(log_token)
+            current_tenant.reset(tenant_token)
@@ -0,0 +1,278 @@
+import asyncio
+import base64
+import hashlib
+import ipaddress
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Один пул процессов на все боты процесса, создается при первой выдаче ключа
+_executor = None
+
+
+def get_executor(max_workers=None):
+    global _executor
+    if _executor is None:
+        # multiprocessing заметно удлиняет импорт - не тянем его при старте
+        from concurrent.futures import ProcessPoolExecutor
+        _executor = ProcessPoolExecutor(max_workers=max_workers)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+# Curve25519 (RFC 7748): WireGuard-ключи - это X25519
+_P = 2 ** 255 - 19
+_A24 = 121665
+
+
+def _x25519(scalar_bytes, u):
+    scalar = bytearray(scalar_bytes)
+    scalar[0] &= 248
+    scalar[31] &= 127
+    scalar[31] |= 64
+    k = int.from_bytes(scalar, 'little')
+
+    x1, x2, z2, x3, z3 = u, 1, 0, u, 1
+    swap = 0
+    for t in reversed(range(255)):
+        bit = (k >> t) & 1
+        swap ^= bit
+        if swap:
+            x2, x3, z2, z3 = x3, x2, z3, z2
+        swap = bit
+        a = x2 + z2
+        aa = a * a % _P
+        b = x2 - z2
+        bb = b * b % _P
+        e = aa - bb
+        c = x3 + z3
+        d = x3 - z3
+        da = d * a % _P
+        cb = c * b % _P
+        x3 = (da + cb) ** 2 % _P
+        z3 = x1 * (da - cb) ** 2 % _P
+        x2 = aa * bb % _P
+        z2 = e * (aa + _A24 * e) % _P
+    if swap:
+        x2, z2 = x3, z3
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, 'little')
+
+
+def generate_keypair():
+    """Новая пара ключей WireGuard в base64: (приватный, публичный)"""
+    private = bytearray(os.urandom(32))
+    private[0] &= 248
+    private[31] &= 127
+    private[31] |= 64
+    public = _x25519(bytes(private), 9)
+    return base64.b64encode(bytes(private)).decode(), base64.b64encode(public).decode()
+
+
+def client_address(key_id, network):
+    """Адрес клиента в сети VPN: .1 - сервер, дальше по id ключа"""
+    net = ipaddress.ip_network(network)
+    address = net.network_address + 1 + key_id
+    if address not in net or address == net.broadcast_address:
+        raise ValueError(f"В сети {network} нет свободного адреса для ключа {key_id}")
+    return f"{address}/{net.max_prefixlen}"
+
+
+def check_client_networks(settings_by_name):
+    """ValueError, если у двух ботов на одном сервере пересекаются сети клиентов"""
+    checked = []
+    for name, settings in settings_by_name.items():
+        network = ipaddress.ip_network(settings['client_network'])
+        for other_name, other_settings, other_network in checked:
+            if (settings['server_public_key'] == other_settings['server_public_key']
+                    and network.overlaps(other_network)):
+                raise ValueError(
+                    f"Боты {other_name} и {name} выдают адреса из пересекающихся сетей "
+                    f"{other_network} и {network} на одном сервере WireGuard"
+                )
+        checked.append((name, settings, network))
+
+
+def render_client_config(private_key, address, settings):
+    lines = [
+        "[Interface]",
+        f"PrivateKey = {private_key}",
+        f"Address = {address}",
+    ]
+    if settings.get('dns'):
+        lines.append(f"DNS = {settings['dns']}")
+    lines += [
+        "",
+        "[Peer]",
+        f"PublicKey = {settings['server_public_key']}",
+        f"AllowedIPs = {settings['allowed_ips']}",
+        f"Endpoint = {settings['endpoint']}",
+        "PersistentKeepalive = 25",
+        "",
+    ]
+    return "\n".join(lines)
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _render_qr(text, path):
+    """QR-код в PNG. False если не установлен qrcode[pil]"""
+    try:
+        import qrcode
+    except ImportError:
+        return False
+    image = qrcode.make(text)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        image.save(f, format='PNG')
+    os.replace(tmp_path, path)
+    return True
+
+
+# Настройки, от которых зависит конфиг клиента (кроме его приватного ключа)
+_CONFIG_SETTINGS = ('server_public_key', 'endpoint', 'dns', 'allowed_ips', 'client_network')
+
+
+def client_files_paths(public_key, settings, cache_dir):
+    """Пути к файлам клиента в кэше.
+
+    Имя - sha256 от публичного ключа клиента и настроек сервера. id ключа
+    для имени не годится: после восстановления или пересоздания базы тот
+    же id получит другой покупатель.
+    """
+    identity = [public_key] + [settings.get(name) for name in _CONFIG_SETTINGS]
+    digest = hashlib.sha256(repr(identity).encode()).hexdigest()
+    base = os.path.join(cache_dir, digest[:2], digest)
+    return {'config': f"{base}.conf", 'qr': f"{base}.png"}
+
+
+def load_client_files(key_id, public_key, settings, cache_dir):
+    """Уже собранные файлы для публичного ключа из базы или None"""
+    if not public_key:
+        return None
+    paths = client_files_paths(public_key, settings, cache_dir)
+    if not os.path.exists(paths['config']):
+        return None
+    return {
+        'config_path': paths['config'],
+        'qr_path': paths['qr'] if os.path.exists(paths['qr']) else None,
+        'public_key': public_key,
+        'address': client_address(key_id, settings['client_network']),
+    }
+
+
+def build_client_files(key_id, settings, cache_dir):
+    """Генерирует новую пару ключей, конфиг и QR-код клиента.
+
+    Выполняется в процессе пула. Файлы называются по новому публичному
+    ключу, поэтому параллельные сборки не перезаписывают друг друга.
+    """
+    private_key, public_key = generate_keypair()
+    address = client_address(key_id, settings['client_network'])
+    config = render_client_config(private_key, address, settings)
+
+    paths = client_files_paths(public_key, settings, cache_dir)
+    os.makedirs(os.path.dirname(paths['config']), exist_ok=True)
+    qr_path = paths['qr'] if _render_qr(config, paths['qr']) else None
+    # Конфиг пишется последним: по нему load_client_files считает сборку готовой
+    _write_atomic(paths['config'], config.encode())
+
+    return {
+        'config_path': paths['config'],
+        'qr_path': qr_path,
+        'public_key': public_key,
+        'address': address,
+    }
+
+
+class ConfigGenerator:
+    """Сборка WireGuard-конфигов для выданных ключей в пуле процессов.
+
+    Обработчик только вызывает schedule() и сразу отвечает. Готовые файлы
+    записываются в keys.config_url и отправляются через outbox.
+    """
+
+    def __init__(self, db, outbox, settings, cache_dir, admin_ids, max_workers=None):
+        self.db = db
+        self.outbox = outbox
+        self.settings = settings
+        self.cache_dir = cache_dir
+        self.admin_ids = admin_ids
+        self.max_workers = max_workers
+        # key_id -> задача сборки. Ключ, выданный пока resume() досоздает
+        # конфиги после старта, не должен собираться второй раз параллельно
+        self._tasks = {}
+
+    def schedule(self, key_id, user_id, admin_id=None):
+        task = self._tasks.get(key_id)
+        if task is not None:
+            return task
+        task = asyncio.create_task(self.generate(key_id, user_id, admin_id))
+        self._tasks[key_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key_id, None))
+        return task
+
+    async def generate(self, key_id, user_id, admin_id=None):
+        loop = asyncio.get_running_loop()
+        try:
+            public_key = self.db.get_key_public_key(key_id)
+            if public_key:
+                # Конфиг этого ключа уже собран и отправлен: возвращаем его файлы
+                # из кэша, без пула и без повторных сообщений
+                return load_client_files(key_id, public_key, self.settings, self.cache_dir)
+            result = await loop.run_in_executor(
+                get_executor(self.max_workers), build_client_files, key_id, self.settings, self.cache_dir
+            )
+        except Exception as e:
+            logger.error(f"Error building WireGuard config for key {key_id}: {e}")
+            return None
+
+        messages = [{
+            'chat_id': user_id,
+            'kind': 'document',
+            'file_path': result['config_path'],
+            'text': "📄 <b>Готовый конфиг WireGuard</b>\n\nИмпортируйте файл в приложение WireGuard",
+        }]
+        if result['qr_path']:
+            messages.append({
+                'chat_id': user_id,
+                'kind': 'photo',
+                'file_path': result['qr_path'],
+                'text': "📱 Или отсканируйте QR-код в мобильном приложении WireGuard",
+            })
+        peer_text = (
+            f"🛠 <b>Добавьте peer на сервер</b> (ключ ID {key_id})\n\n"
+            f"<code>[Peer]\nPublicKey = {result['public_key']}\n"
+            f"AllowedIPs = {result['address']}</code>"
+        )
+        for chat_id in ([admin_id] if admin_id else self.admin_ids):
+            messages.append({'chat_id': chat_id, 'kind': 'text', 'file_path': None, 'text': peer_text})
+
+        # Путь к конфигу, публичный ключ и сообщения - одной транзакцией.
+        # Если конфиг уже сохранила другая сборка, эта ничего не отправляет
+        if not self.db.set_key_config(
+            key_id, result['config_path'], messages, public_key=result['public_key']
+        ):
+            logger.warning(f"WireGuard config for key {key_id} was already saved, skipping")
+            return None
+        self.outbox.wake()
+        return result
+
+    def resume(self):
+        """Досоздает конфиги, которые не успели собраться до перезапуска"""
+        for key in self.db.get_keys_pending_config():
+            self.schedule(key['id'], key['user_id'])
+
+    async def close(self):
+        for task in list(self._tasks.values()):
+            task.cancel()